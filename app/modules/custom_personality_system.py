@@ -5,7 +5,6 @@
 """
 
 import logging
-from datetime import datetime
 from typing import Optional, Dict, List
 
 logger = logging.getLogger(__name__)
@@ -33,9 +32,19 @@ class CustomPersonalityManager:
         try:
             await self.db.execute(
                 """
-                INSERT OR REPLACE INTO custom_personalities
+                INSERT INTO custom_personalities
                 (id, personality_name, personality_description, system_prompt, chat_id, user_id, admin_id, created_at, is_group_personality, is_active)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+                VALUES (?, ?, ?, ?, ?, ?, ?, strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime'), ?, 1)
+                ON CONFLICT(id) DO UPDATE SET
+                    personality_name = excluded.personality_name,
+                    personality_description = excluded.personality_description,
+                    system_prompt = excluded.system_prompt,
+                    chat_id = excluded.chat_id,
+                    user_id = excluded.user_id,
+                    admin_id = excluded.admin_id,
+                    created_at = excluded.created_at,
+                    is_group_personality = excluded.is_group_personality,
+                    is_active = 1
                 """,
                 (
                     personality_id,
@@ -45,7 +54,6 @@ class CustomPersonalityManager:
                     chat_id,
                     user_id,
                     admin_id,
-                    datetime.now().isoformat(),
                     1 if is_group else 0,
                 ),
             )
@@ -23,11 +23,11 @@ class KarmaManager:
             # Проверим наличие таблицы (на всякий случай)
             await self.db.execute("""
                 CREATE TABLE IF NOT EXISTS karma (
-                    user_id INTEGER,
-                    chat_id INTEGER,
+                    user_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
                     points INTEGER DEFAULT 0,
                     PRIMARY KEY (user_id, chat_id)
-                )
+                ) WITHOUT ROWID, STRICT
             """)
             logger.info("⚖️ KarmaManager готов к работе")
         except Exception as e:
@@ -36,11 +36,11 @@ class KarmaManager:
     async def get_karma(self, user_id: int, chat_id: int) -> int:
         """🔍 Получить карму пользователя"""
         try:
-            row = await self.db.fetch_one(
+            points = await self.db.fetch_scalar(
                 "SELECT points FROM karma WHERE user_id = ? AND chat_id = ?",
                 (user_id, chat_id),
             )
-            return row["points"] if row else 0
+            return points or 0
         except Exception as e:
             logger.error(f"❌ Ошибка получения кармы: {e}")
             return 0
@@ -48,17 +48,17 @@ class KarmaManager:
     async def add_karma(self, user_id: int, chat_id: int, delta: int) -> int:
         """➕ Изменить карму пользователя"""
         try:
-            current = await self.get_karma(user_id, chat_id)
-            new_value = current + delta
-
-            await self.db.execute(
+            row = await self.db.fetch_one(
                 """
-                INSERT OR REPLACE INTO karma (user_id, chat_id, points)
+                INSERT INTO karma (user_id, chat_id, points)
                 VALUES (?, ?, ?)
+                ON CONFLICT(user_id, chat_id) DO UPDATE SET points = points + excluded.points
+                RETURNING points
                 """,
-                (user_id, chat_id, new_value),
+                (user_id, chat_id, delta),
             )
-            logger.info(f"⚖️ Карма {user_id} в чате {chat_id}: {current} -> {new_value}")
+            new_value = row["points"]
+            logger.info(f"⚖️ Карма {user_id} в чате {chat_id}: {delta:+d} -> {new_value}")
             return new_value
         except Exception as e:
             logger.error(f"❌ Ошибка изменения кармы: {e}")
@@ -69,8 +69,9 @@ class KarmaManager:
         try:
             await self.db.execute(
                 """
-                INSERT OR REPLACE INTO karma (user_id, chat_id, points)
+                INSERT INTO karma (user_id, chat_id, points)
                 VALUES (?, ?, ?)
+                ON CONFLICT(user_id, chat_id) DO UPDATE SET points = excluded.points
                 """,
                 (user_id, chat_id, value),
             )
@@ -40,8 +40,27 @@ class AIService:
             'claude-3-5-sonnet-20241022', 'claude-3-haiku-20240307', 'claude-3-opus-20240229'
         ]
         
+        # HTTP сессия создается в warmup(), конструктор не делает I/O
+        self._session: Optional[aiohttp.ClientSession] = None
+        
         logger.info("🧠 AI Service инициализирован")
     
+    async def warmup(self):
+        """🔥 Прогрев: создание общей HTTP сессии"""
+        self._get_session()
+        logger.info("🔥 AI Service прогрет")
+    
+    async def close(self):
+        """🛑 Закрытие HTTP сессии"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """🌐 Общая HTTP сессия (пул соединений переиспользуется между запросами)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+    
     async def generate_response(self, prompt: str, user_id: int = None, 
                               context: Dict = None) -> Optional[str]:
         """🎯 Генерация ответа от AI"""
@@ -109,14 +128,14 @@ class AIService:
                 "temperature": self.ai_config.temperature
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=data, timeout=30) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        return result['choices'][0]['message']['content'].strip()
-                    else:
-                        logger.error(f"OpenAI API ошибка {resp.status}: {await resp.text()}")
-                        return None
+            session = self._get_session()
+            async with session.post(url, headers=headers, json=data, timeout=30) as resp:
+                if resp.status == 200:
+                    result = await resp.json()
+                    return result['choices'][0]['message']['content'].strip()
+                else:
+                    logger.error(f"OpenAI API ошибка {resp.status}: {await resp.text()}")
+                    return None
                         
         except Exception as e:
             logger.error(f"❌ Ошибка вызова OpenAI: {e}")
@@ -152,14 +171,14 @@ class AIService:
                 ]
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=data, timeout=30) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        return result['content'][0]['text'].strip()
-                    else:
-                        logger.error(f"Anthropic API ошибка {resp.status}: {await resp.text()}")
-                        return None
+            session = self._get_session()
+            async with session.post(url, headers=headers, json=data, timeout=30) as resp:
+                if resp.status == 200:
+                    result = await resp.json()
+                    return result['content'][0]['text'].strip()
+                else:
+                    logger.error(f"Anthropic API ошибка {resp.status}: {await resp.text()}")
+                    return None
                         
         except Exception as e:
             logger.error(f"❌ Ошибка вызова Anthropic: {e}")
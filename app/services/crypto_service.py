@@ -11,5 +11,8 @@ class CryptoService:
         self.config = config
         logger.info("₿ CryptoService initialized (stub)")
 
+    async def warmup(self):
+        logger.info("₿ CryptoService warmed up (stub)")
+
     async def close(self):
         logger.info("₿ CryptoService closed (stub)")
@@ -14,9 +14,14 @@ import logging
 from pathlib import Path
 from typing import List
 from dataclasses import dataclass, field
-from dotenv import load_dotenv
 
-load_dotenv()
+# .env читаем только если окружение не задано оркестратором
+if not os.getenv("BOT_TOKEN") and Path(".env").exists():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
 
 logger = logging.getLogger(__name__)
 
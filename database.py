@@ -9,13 +9,213 @@ import logging
 import sqlite3
 import aiosqlite
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, List, Optional
 from pathlib import Path
 import json
 
 logger = logging.getLogger(__name__)
 
 
+# =================== СХЕМА ===================
+
+_TABLES = (
+    # Пользователи
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        full_name TEXT,
+        language_code TEXT,
+        is_premium BOOLEAN DEFAULT FALSE,
+        is_bot BOOLEAN DEFAULT FALSE,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Чаты
+    """
+    CREATE TABLE IF NOT EXISTS chats (
+        id INTEGER PRIMARY KEY,
+        type TEXT NOT NULL,
+        title TEXT,
+        username TEXT,
+        description TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Логи сообщений
+    """
+    CREATE TABLE IF NOT EXISTS chat_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        text TEXT,
+        message_type TEXT DEFAULT 'text',
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Сообщения
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id INTEGER,
+        user_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        text TEXT,
+        message_type TEXT DEFAULT 'text',
+        reply_to_message_id INTEGER,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Действия пользователей
+    """
+    CREATE TABLE IF NOT EXISTS user_actions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        chat_id INTEGER,
+        action TEXT NOT NULL,
+        details TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Системные настройки
+    """
+    CREATE TABLE IF NOT EXISTS system_settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        updated_by INTEGER,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # AI взаимодействия
+    """
+    CREATE TABLE IF NOT EXISTS ai_interactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        chat_id INTEGER,
+        prompt TEXT NOT NULL,
+        response TEXT,
+        model_used TEXT,
+        tokens_used INTEGER,
+        response_time REAL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Память диалогов
+    """
+    CREATE TABLE IF NOT EXISTS memory_contexts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        chat_id INTEGER,
+        context_key TEXT NOT NULL,
+        context_value TEXT NOT NULL,
+        expires_at DATETIME,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Триггеры
+    """
+    CREATE TABLE IF NOT EXISTS triggers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER,
+        user_id INTEGER NOT NULL,
+        trigger_text TEXT NOT NULL,
+        response_text TEXT NOT NULL,
+        is_regex BOOLEAN DEFAULT FALSE,
+        is_global BOOLEAN DEFAULT FALSE,
+        is_active BOOLEAN DEFAULT TRUE,
+        usage_count INTEGER DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Модерация - баны
+    """
+    CREATE TABLE IF NOT EXISTS bans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        chat_id INTEGER,
+        admin_id INTEGER NOT NULL,
+        reason TEXT,
+        ban_type TEXT DEFAULT 'permanent',
+        expires_at DATETIME,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Модерация - предупреждения
+    """
+    CREATE TABLE IF NOT EXISTS warnings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        admin_id INTEGER NOT NULL,
+        reason TEXT,
+        severity_level INTEGER DEFAULT 1,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Аналитика поведения
+    """
+    CREATE TABLE IF NOT EXISTS behavior_patterns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        pattern_type TEXT NOT NULL,
+        pattern_data TEXT NOT NULL,
+        confidence REAL DEFAULT 0.0,
+        last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Custom personalities
+    """
+    CREATE TABLE IF NOT EXISTS custom_personalities (
+        id TEXT PRIMARY KEY,
+        description TEXT,
+        system_prompt TEXT,
+        chat_id INTEGER,
+        user_id INTEGER,
+        created_at TEXT,
+        is_active INTEGER DEFAULT 1,
+        personality_name TEXT,
+        personality_description TEXT,
+        is_group_personality INTEGER DEFAULT 0,
+        admin_id INTEGER
+    )
+    """,
+    # Karma
+    """
+    CREATE TABLE IF NOT EXISTS karma (
+        user_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        points INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, chat_id)
+    ) WITHOUT ROWID, STRICT
+    """,
+)
+
+_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_chat_logs_user ON chat_logs(user_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_logs_chat ON chat_logs(chat_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_logs_ts ON chat_logs(timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages(chat_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_user_actions_user ON user_actions(user_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_ai_interactions_user ON ai_interactions(user_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_memory_contexts_user ON memory_contexts(user_id, chat_id)",
+    "CREATE INDEX IF NOT EXISTS idx_memctx_lookup ON memory_contexts(user_id, chat_id, context_key, expires_at, context_value)",
+    "CREATE INDEX IF NOT EXISTS idx_memctx_expires ON memory_contexts(expires_at) WHERE expires_at IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_triggers_live ON triggers(chat_id) WHERE is_active = 1",
+    "CREATE INDEX IF NOT EXISTS idx_bans_live ON bans(user_id, chat_id) WHERE is_active = 1",
+    "CREATE INDEX IF NOT EXISTS idx_warnings_live ON warnings(user_id, chat_id) WHERE is_active = 1",
+    "CREATE INDEX IF NOT EXISTS idx_behavior_user ON behavior_patterns(user_id, pattern_type)",
+)
+
+
 class DatabaseService:
     """💾 Сервис работы с базой данных"""
     
@@ -29,16 +229,30 @@ class DatabaseService:
         """🚀 Инициализация базы данных"""
         try:
             Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
-            self.connection = await aiosqlite.connect(self.db_path, timeout=30.0)
+            # Автокоммит: транзакции открываем явно только для пакетной записи
+            self.connection = await aiosqlite.connect(
+                self.db_path, timeout=30.0, isolation_level=None, cached_statements=512
+            )
+            # sqlite3.Row: доступ по имени колонки без сборки dict на каждую строку
+            self.connection.row_factory = aiosqlite.Row
+            
+            # page_size можно задать только для новой БД и до перехода в WAL
+            async with self.connection.execute("PRAGMA page_count") as cursor:
+                (page_count,) = await cursor.fetchone()
+            if page_count == 0:
+                await self.connection.execute("PRAGMA page_size=32768")
             
             if self.config.wal_mode:
                 await self.connection.execute("PRAGMA journal_mode=WAL")
             
             await self.connection.execute("PRAGMA foreign_keys=ON")
-            await self.connection.execute("PRAGMA cache_size=-2000")
+            await self.connection.execute("PRAGMA cache_size=-65536")
             await self.connection.execute("PRAGMA synchronous=NORMAL")
+            await self.connection.execute("PRAGMA mmap_size=268435456")
+            await self.connection.execute("PRAGMA temp_store=MEMORY")
             
             await self._create_tables()
+            await self._migrate_schema()
             await self._create_indexes()
             
             logger.info("🚀 База данных инициализирована")
@@ -49,227 +263,93 @@ class DatabaseService:
     async def close(self):
         """🔒 Закрытие соединения"""
         if self.connection:
+            # Обновляем статистику планировщика перед закрытием
+            await self.connection.execute("PRAGMA analysis_limit=400")
+            await self.connection.execute("PRAGMA optimize")
             await self.connection.close()
             logger.info("🔒 База данных закрыта")
     
     async def _create_tables(self):
         """📋 Создание всех таблиц"""
-        tables = [
-            # Пользователи
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                full_name TEXT,
-                language_code TEXT,
-                is_premium BOOLEAN DEFAULT FALSE,
-                is_bot BOOLEAN DEFAULT FALSE,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            # Чаты
-            """
-            CREATE TABLE IF NOT EXISTS chats (
-                id INTEGER PRIMARY KEY,
-                type TEXT NOT NULL,
-                title TEXT,
-                username TEXT,
-                description TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            # Логи сообщений
-            """
-            CREATE TABLE IF NOT EXISTS chat_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                username TEXT,
-                full_name TEXT,
-                text TEXT,
-                message_type TEXT DEFAULT 'text',
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            # Сообщения
-            """
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                message_id INTEGER,
-                user_id INTEGER NOT NULL,
-                chat_id INTEGER NOT NULL,
-                text TEXT,
-                message_type TEXT DEFAULT 'text',
-                reply_to_message_id INTEGER,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            # Действия пользователей
-            """
-            CREATE TABLE IF NOT EXISTS user_actions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                chat_id INTEGER,
-                action TEXT NOT NULL,
-                details TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            # Системные настройки
-            """
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL,
-                updated_by INTEGER,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            # AI взаимодействия
-            """
-            CREATE TABLE IF NOT EXISTS ai_interactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                chat_id INTEGER,
-                prompt TEXT NOT NULL,
-                response TEXT,
-                model_used TEXT,
-                tokens_used INTEGER,
-                response_time REAL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            # Память диалогов
-            """
-            CREATE TABLE IF NOT EXISTS memory_contexts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                chat_id INTEGER,
-                context_key TEXT NOT NULL,
-                context_value TEXT NOT NULL,
-                expires_at DATETIME,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            # Триггеры
-            """
-            CREATE TABLE IF NOT EXISTS triggers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER,
-                user_id INTEGER NOT NULL,
-                trigger_text TEXT NOT NULL,
-                response_text TEXT NOT NULL,
-                is_regex BOOLEAN DEFAULT FALSE,
-                is_global BOOLEAN DEFAULT FALSE,
-                is_active BOOLEAN DEFAULT TRUE,
-                usage_count INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            # Модерация - баны
-            """
-            CREATE TABLE IF NOT EXISTS bans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                chat_id INTEGER,
-                admin_id INTEGER NOT NULL,
-                reason TEXT,
-                ban_type TEXT DEFAULT 'permanent',
-                expires_at DATETIME,
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            # Модерация - предупреждения
-            """
-            CREATE TABLE IF NOT EXISTS warnings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                chat_id INTEGER NOT NULL,
-                admin_id INTEGER NOT NULL,
-                reason TEXT,
-                severity_level INTEGER DEFAULT 1,
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            # Аналитика поведения
-            """
-            CREATE TABLE IF NOT EXISTS behavior_patterns (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                pattern_type TEXT NOT NULL,
-                pattern_data TEXT NOT NULL,
-                confidence REAL DEFAULT 0.0,
-                last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            # Custom personalities
-            """
-            CREATE TABLE IF NOT EXISTS custom_personalities (
-                id TEXT PRIMARY KEY,
-                description TEXT,
-                system_prompt TEXT,
-                chat_id INTEGER,
-                user_id INTEGER,
-                created_at TEXT,
-                is_active INTEGER DEFAULT 1,
-                personality_name TEXT,
-                personality_description TEXT,
-                is_group_personality INTEGER DEFAULT 0,
-                admin_id INTEGER
-            )
-            """,
-            # Karma
-            """
-            CREATE TABLE IF NOT EXISTS karma (
-                user_id INTEGER,
-                chat_id INTEGER,
-                points INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, chat_id)
-            )
-            """
-        ]
+        await self.connection.executescript(
+            "BEGIN;\n" + ";\n".join(_TABLES) + ";\nCOMMIT;"
+        )
+        logger.info("📋 Все таблицы созданы")
+    
+    async def _migrate_schema(self):
+        """🔄 Приведение старых таблиц к текущей схеме"""
+        # username/full_name берутся из users, в chat_logs они не хранятся
+        async with self.connection.execute("PRAGMA table_info(chat_logs)") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        for column in ("username", "full_name"):
+            if column in columns:
+                await self.connection.execute(f"ALTER TABLE chat_logs DROP COLUMN {column}")
         
-        for table_sql in tables:
-            try:
-                await self.connection.execute(table_sql)
-            except Exception as e:
-                logger.error(f"❌ Ошибка создания таблицы: {e}")
+        # Полные индексы по is_active заменены частичными (*_live)
+        for index in ("idx_triggers_active", "idx_bans_active", "idx_warnings_active"):
+            await self.connection.execute(f"DROP INDEX IF EXISTS {index}")
         
-        await self.connection.commit()
-        logger.info("📋 Все таблицы созданы")
+        # karma: WITHOUT ROWID, STRICT — строки лежат прямо в B-дереве первичного ключа
+        async with self.connection.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'karma'"
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row and "WITHOUT ROWID" not in row[0].upper():
+            await self.connection.executescript("""
+                BEGIN;
+                CREATE TABLE karma_new (
+                    user_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    points INTEGER DEFAULT 0,
+                    PRIMARY KEY (user_id, chat_id)
+                ) WITHOUT ROWID, STRICT;
+                INSERT INTO karma_new (user_id, chat_id, points)
+                SELECT user_id, chat_id, CAST(points AS INTEGER) FROM karma
+                WHERE user_id IS NOT NULL AND chat_id IS NOT NULL;
+                DROP TABLE karma;
+                ALTER TABLE karma_new RENAME TO karma;
+                COMMIT;
+            """)
     
     async def _create_indexes(self):
         """🚀 Создание индексов"""
-        indexes = [
-            "CREATE INDEX IF NOT EXISTS idx_chat_logs_user ON chat_logs(user_id, timestamp)",
-            "CREATE INDEX IF NOT EXISTS idx_chat_logs_chat ON chat_logs(chat_id, timestamp)",
-            "CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id, timestamp)",
-            "CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages(chat_id, timestamp)",
-            "CREATE INDEX IF NOT EXISTS idx_user_actions_user ON user_actions(user_id, timestamp)",
-            "CREATE INDEX IF NOT EXISTS idx_ai_interactions_user ON ai_interactions(user_id, timestamp)",
-            "CREATE INDEX IF NOT EXISTS idx_memory_contexts_user ON memory_contexts(user_id, chat_id)",
-            "CREATE INDEX IF NOT EXISTS idx_triggers_active ON triggers(is_active, chat_id)",
-            "CREATE INDEX IF NOT EXISTS idx_bans_active ON bans(is_active, user_id, chat_id)",
-            "CREATE INDEX IF NOT EXISTS idx_warnings_active ON warnings(is_active, user_id, chat_id)",
-            "CREATE INDEX IF NOT EXISTS idx_behavior_user ON behavior_patterns(user_id, pattern_type)"
-        ]
-        
-        for index_sql in indexes:
-            try:
-                await self.connection.execute(index_sql)
-            except Exception as e:
-                logger.error(f"❌ Ошибка создания индекса: {e}")
-        
-        await self.connection.commit()
+        await self.connection.executescript(
+            "BEGIN;\n" + ";\n".join(_INDEXES) + ";\nCOMMIT;"
+        )
         logger.info("🚀 Индексы созданы")
     
+    # =================== ЗАПРОСЫ ===================
+    
+    async def execute(self, query: str, params: tuple = ()):
+        """⚡ Выполнение запроса на изменение"""
+        return await self.connection.execute(query, params)
+    
+    async def execute_many(self, query: str, rows: Iterable[tuple]):
+        """📦 Пакетная запись строк одной транзакцией"""
+        await self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            await self.connection.executemany(query, rows)
+        except Exception:
+            await self.connection.execute("ROLLBACK")
+            raise
+        await self.connection.execute("COMMIT")
+    
+    async def fetch_one(self, query: str, params: tuple = ()) -> Optional[aiosqlite.Row]:
+        """🔍 Получение одной строки"""
+        async with self.connection.execute(query, params) as cursor:
+            return await cursor.fetchone()
+    
+    async def fetch_scalar(self, query: str, params: tuple = ()) -> Any:
+        """🎯 Получение одного значения (первая колонка первой строки)"""
+        async with self.connection.execute(query, params) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row is not None else None
+    
+    async def fetch_all(self, query: str, params: tuple = ()) -> List[aiosqlite.Row]:
+        """📋 Получение всех строк"""
+        async with self.connection.execute(query, params) as cursor:
+            return await cursor.fetchall()
+    
 
 # =================== ИНИЦИАЛИЗАЦИЯ ===================
 
@@ -5,72 +5,132 @@
 """
 
 import asyncio
+import importlib.util
 import logging
+import logging.handlers
 import os
+import queue
+import signal
 import sys
+from dataclasses import dataclass, fields
 from pathlib import Path
+from types import ModuleType
+from typing import Any, List, Optional
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
+# Байткод кэшируется (в образе собирается заранее, см. compileall в Dockerfile)
+sys.dont_write_bytecode = False
+
 # Основные импорты
 try:
     from config_harsh import load_config
     from database import DatabaseService
 except ImportError as e:
-    print(f"❌ ОШИБКА: Не найден модуль {e.name}")
-    print("Создайте файлы config_harsh.py и database.py")
-    input("Нажмите Enter для выхода...")
+    print(f"❌ ОШИБКА: Не найден модуль {e.name}", file=sys.stderr)
+    print("Создайте файлы config_harsh.py и database.py", file=sys.stderr)
+    # Под systemd/Docker stdin не терминал - ждать Enter некому
+    if sys.stdin is not None and sys.stdin.isatty():
+        input("Нажмите Enter для выхода...")
     sys.exit(1)
 
+
+# NWCH_EAGER_IMPORT=1 - грузить все модули сразу (CI ловит ошибки импорта на старте)
+EAGER_IMPORT = os.getenv("NWCH_EAGER_IMPORT") == "1"
+
+
+def lazy_import(name: str) -> Optional[ModuleType]:
+    """💤 Ленивый импорт: модуль загружается при первом обращении к атрибуту"""
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+    if EAGER_IMPORT:
+        return importlib.import_module(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+# Стартовые сообщения копятся и выводятся пачкой (одна запись в stdout)
+_banner: List[str] = []
+
+
+def say(message: str = ""):
+    """📝 Добавить строку в стартовый баннер"""
+    _banner.append(message)
+
+
+def flush_banner():
+    """📤 Вывести накопленный баннер одной записью"""
+    if _banner:
+        sys.stdout.write("\n".join(_banner) + "\n")
+        sys.stdout.flush()
+        _banner.clear()
+
+
+def lazy_attr(module: Optional[ModuleType], name: str) -> Any:
+    """🔌 Атрибут ленивого модуля; None, если модуль не импортируется"""
+    if module is None:
+        return None
+    try:
+        # Здесь ленивый модуль впервые исполняется - ошибки импорта всплывают тут
+        return getattr(module, name)
+    except (ImportError, AttributeError) as e:
+        say(f"⚠️ {module.__name__} недоступен: {e}")
+        return None
+
+
 # Опциональные сервисы
-modules_available = False
-try:
-    from app.services.ai_service import AIService
-    from app.services.analytics_service import AnalyticsService
-    from app.services.crypto_service import CryptoService
-    modules_available = True
-except ImportError as e:
-    print(f"⚠️ Сервисы недоступны: {e}")
+_ai_mod = lazy_import("app.services.ai_service")
+_analytics_mod = lazy_import("app.services.analytics_service")
+_crypto_mod = lazy_import("app.services.crypto_service")
+modules_available = None not in (_ai_mod, _analytics_mod, _crypto_mod)
+if not modules_available:
+    say("⚠️ Сервисы недоступны")
 
 # Системы персонажей и кармы
-personality_system_available = False
-karma_system_available = False
+_personality_mod = lazy_import("app.modules.custom_personality_system")
+personality_system_available = _personality_mod is not None
+if personality_system_available:
+    say("✅ Система персонажей найдена!")
+else:
+    say("⚠️ Система персонажей недоступна")
+
+_karma_mod = lazy_import("app.modules.karma_system")
+karma_system_available = _karma_mod is not None
+if karma_system_available:
+    say("✅ Система кармы найдена!")
+else:
+    say("⚠️ Система кармы недоступна")
 
-try:
-    from app.modules.custom_personality_system import CustomPersonalityManager
-    personality_system_available = True
-    print("✅ Система персонажей найдена!")
-except ImportError as e:
-    print(f"⚠️ Система персонажей недоступна: {e}")
+# Обработчики
+_karma_handlers_mod = lazy_import("app.handlers.karma_handlers")
+if _karma_handlers_mod is not None:
+    say("✅ Karma handlers найдены")
+
+# Порядок предпочтения: первый найденный модуль и регистрирует обработчики
+HANDLER_MODULES = (
+    ("app.handlers.handlers_v3_fixed", "✅ Обработчики найдены"),
+    ("app.handlers.handlers_v3_simple", "✅ Простые обработчики найдены"),
+)
 
-try:
-    from app.modules.karma_system import KarmaManager
-    karma_system_available = True
-    print("✅ Система кармы найдена!")
-except ImportError as e:
-    print(f"⚠️ Система кармы недоступна: {e}")
+_handler_mods: List[ModuleType] = []
+for _name, _found_message in HANDLER_MODULES:
+    _mod = lazy_import(_name)
+    if _mod is not None:
+        if not _handler_mods:
+            say(_found_message)
+        _handler_mods.append(_mod)
 
-# Обработчики
-handlers_available = False
-try:
-    from app.handlers.karma_handlers import setup_karma_handlers
-    handlers_available = True
-    print("✅ Karma handlers найдены")
-except ImportError:
-    try:
-        from app.handlers.handlers_v3_fixed import register_all_handlers
-        handlers_available = True
-        print("✅ Обработчики найдены")
-    except ImportError:
-        try:
-            from app.handlers.handlers_v3_simple import register_all_handlers
-            handlers_available = True
-            print("✅ Простые обработчики найдены")
-        except ImportError as e:
-            print(f"❌ Обработчики недоступны: {e}")
+handlers_available = _karma_handlers_mod is not None or bool(_handler_mods)
+if not handlers_available:
+    say("❌ Обработчики недоступны")
 
 # Настройка логирования
 logging.basicConfig(
@@ -80,47 +140,108 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+@dataclass(slots=True)
+class BotContext:
+    """📦 Модули бота, доступные обработчикам"""
+    config: Any = None
+    db: Any = None
+    bot: Any = None
+    ai: Any = None
+    analytics_service: Any = None
+    crypto_service: Any = None
+    custom_personality_manager: Any = None
+    karma_manager: Any = None
+    ultimate: Any = None
+
+    # Совместимость с обработчиками, ожидающими dict
+    def __getitem__(self, name: str) -> Any:
+        if name not in self:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __contains__(self, name: str) -> bool:
+        return getattr(self, name, None) is not None
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self[name] if name in self else default
+
+    def keys(self) -> List[str]:
+        return [f.name for f in fields(self) if f.name in self]
+
+
+# Рабочие директории; sentinel пропадает вместе с data/
+STARTUP_DIRS = ('data/logs', 'data/backups', 'app/services', 'app/modules', 'app/handlers')
+DIRS_SENTINEL = Path("data/.dirs_ready")
+
+
+BOT_COMMANDS = [
+    BotCommand(command="start", description="Запуск бота"),
+    BotCommand(command="help", description="Справка"),
+    BotCommand(command="be", description="Установить персонажа"),
+    BotCommand(command="reset_persona", description="Сбросить персонажа"),
+    BotCommand(command="current_persona", description="Текущий персонаж"),
+    BotCommand(command="karma", description="Моя карма"),
+]
+
+
 async def setup_bot_commands(bot: Bot):
     """⚙️ Настройка команд бота"""
-    commands = [
-        BotCommand(command="start", description="Запуск бота"),
-        BotCommand(command="help", description="Справка"),
-        BotCommand(command="be", description="Установить персонажа"),
-        BotCommand(command="reset_persona", description="Сбросить персонажа"),
-        BotCommand(command="current_persona", description="Текущий персонаж"),
-        BotCommand(command="karma", description="Моя карма"),
-    ]
-    await bot.set_my_commands(commands)
+    await bot.set_my_commands(BOT_COMMANDS)
     logger.info("⚙️ Команды настроены")
 
 
+async def notify_admins(bot: Bot, admin_ids: List[int], text: str):
+    """📤 Уведомление админов о запуске"""
+    results = await asyncio.gather(
+        *(bot.send_message(admin_id, text) for admin_id in admin_ids),
+        return_exceptions=True,
+    )
+    for admin_id, result in zip(admin_ids, results):
+        if isinstance(result, Exception):
+            say(f"  ⚠️ Не удалось уведомить {admin_id}: {result}")
+        else:
+            say(f"  📤 Админ уведомлен: {admin_id}")
+    flush_banner()
+
+
 async def main():
     """💀 Основная функция запуска"""
-    print("🎭 ENHANCED TELEGRAM BOT v3.0 - БАЗОВАЯ ВЕРСИЯ")
-    print("=" * 50)
+    say("🎭 ENHANCED TELEGRAM BOT v3.0 - БАЗОВАЯ ВЕРСИЯ")
+    say("=" * 50)
 
+    ctx = BotContext()
+    startup_tasks = []
+    bot: Optional[Bot] = None
+    log_listener = None
     try:
-        # Создаем директории
-        for d in ['data/logs', 'data/backups', 'app/services', 'app/modules', 'app/handlers']:
-            Path(d).mkdir(parents=True, exist_ok=True)
-
-        # Логирование в файл
-        file_handler = logging.FileHandler('data/logs/bot.log', encoding='utf-8')
+        # Создаем директории (один раз, пока жив data/)
+        if not DIRS_SENTINEL.exists():
+            for d in STARTUP_DIRS:
+                os.makedirs(d, exist_ok=True)
+            DIRS_SENTINEL.touch()
+
+        # Логирование в файл: запись на диск в фоновом потоке, не в event loop
+        file_handler = logging.FileHandler('data/logs/bot.log', encoding='utf-8', delay=True)
         file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        logging.getLogger().addHandler(file_handler)
+        log_queue = queue.SimpleQueue()
+        logging.getLogger().addHandler(logging.handlers.QueueHandler(log_queue))
+        log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+        log_listener.start()
 
         # Загружаем конфигурацию
         config = load_config()
         if not config.bot.token:
-            print("❌ ОШИБКА: BOT_TOKEN не найден в .env!")
+            flush_banner()
+            print("❌ ОШИБКА: BOT_TOKEN не найден в .env!", file=sys.stderr)
             return
         if not config.bot.admin_ids:
-            print("❌ ОШИБКА: ADMIN_IDS не указаны в .env!")
+            flush_banner()
+            print("❌ ОШИБКА: ADMIN_IDS не указаны в .env!", file=sys.stderr)
             return
 
-        print(f"👑 АДМИНЫ: {config.bot.admin_ids}")
+        say(f"👑 АДМИНЫ: {config.bot.admin_ids}")
         if config.bot.allowed_chat_ids:
-            print(f"🔒 РАЗРЕШЕННЫЕ ЧАТЫ: {config.bot.allowed_chat_ids}")
+            say(f"🔒 РАЗРЕШЕННЫЕ ЧАТЫ: {config.bot.allowed_chat_ids}")
 
         # Создаем бота
         bot = Bot(
@@ -129,115 +250,172 @@ async def main():
         )
         dp = Dispatcher(storage=MemoryStorage())
 
-        # Проверяем подключение
-        bot_info = await bot.get_me()
-        print(f"🤖 Подключен: @{bot_info.username}")
+        # bot.me() запоминает ответ: start_polling возьмет его же, второго getMe не будет
+        bot_info = await bot.me()
+        say(f"🤖 Подключен: @{bot_info.username}")
 
-        # Инициализация базы данных
-        print("💾 Инициализация базы данных...")
+        # Контекст модулей (конструкторы без I/O, подключения - ниже параллельно)
         db_service = DatabaseService(config.database)
-        await db_service.initialize()
-
-        # Словарь модулей
-        modules = {"config": config, "db": db_service, "bot": bot}
+        ctx.config, ctx.db, ctx.bot = config, db_service, bot
 
         # Сервисы
         if modules_available:
-            print("🧠 Инициализация сервисов...")
+            say("🧠 Инициализация сервисов...")
             try:
-                modules["ai"] = AIService(config)
-                print("  ✅ AI сервис активирован")
+                ctx.ai = _ai_mod.AIService(config)
+                say("  ✅ AI сервис активирован")
             except Exception:
-                print("  ❌ AI сервис недоступен")
+                say("  ❌ AI сервис недоступен")
 
             try:
-                modules["analytics_service"] = AnalyticsService(db_service)
-                print("  ✅ Аналитика активирована")
+                ctx.analytics_service = _analytics_mod.AnalyticsService(db_service)
+                say("  ✅ Аналитика активирована")
             except Exception:
-                print("  ❌ Аналитика недоступна")
+                say("  ❌ Аналитика недоступна")
 
             try:
-                modules["crypto_service"] = CryptoService(config)
-                print("  ✅ Крипто сервис активирован")
+                ctx.crypto_service = _crypto_mod.CryptoService(config)
+                say("  ✅ Крипто сервис активирован")
             except Exception:
-                print("  ❌ Крипто сервис недоступен")
-
-        # Система персонажей
-        if personality_system_available:
-            print("🎭 Инициализация системы персонажей...")
-            modules["custom_personality_manager"] = CustomPersonalityManager(
-                db_service, config, modules.get("ai")
-            )
-            if hasattr(modules["custom_personality_manager"], "initialize"):
-                await modules["custom_personality_manager"].initialize()
-            print("  ✅ Система персонажей готова")
-
-        # Система кармы
-        if karma_system_available:
-            print("⚖️ Инициализация системы кармы...")
-            modules["karma_manager"] = KarmaManager(db_service, config)
-            if hasattr(modules["karma_manager"], "initialize"):
-                await modules["karma_manager"].initialize()
-            print("  ✅ Система кармы готова")
+                say("  ❌ Крипто сервис недоступен")
+
+        # База данных и прогрев сетевых сервисов идут одновременно
+        say("💾 Инициализация базы данных...")
+        warmups = [service for service in (ctx.ai, ctx.crypto_service) if hasattr(service, "warmup")]
+        db_result, *warmup_results = await asyncio.gather(
+            db_service.initialize(),
+            *(service.warmup() for service in warmups),
+            return_exceptions=True,
+        )
+        if isinstance(db_result, BaseException):
+            raise db_result
+        for service, result in zip(warmups, warmup_results):
+            if isinstance(result, Exception):
+                say(f"  ⚠️ Прогрев {type(service).__name__} не удался: {result}")
+
+        # Системы персонажей и кармы: инициализируются параллельно
+        managers = []
+        personality_cls = lazy_attr(_personality_mod, "CustomPersonalityManager")
+        if personality_cls is not None:
+            say("🎭 Инициализация системы персонажей...")
+            ctx.custom_personality_manager = personality_cls(db_service)
+            managers.append(ctx.custom_personality_manager)
+
+        karma_cls = lazy_attr(_karma_mod, "KarmaManager")
+        if karma_cls is not None:
+            say("⚖️ Инициализация системы кармы...")
+            ctx.karma_manager = karma_cls(db_service)
+            managers.append(ctx.karma_manager)
+
+        results = await asyncio.gather(
+            *(manager.initialize() for manager in managers if hasattr(manager, "initialize")),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"❌ Ошибка инициализации модуля: {result}")
+        if ctx.custom_personality_manager is not None:
+            say("  ✅ Система персонажей готова")
+        if ctx.karma_manager is not None:
+            say("  ✅ Система кармы готова")
 
         # Обработчики
+        handlers_registered = False
         if handlers_available:
-            print("🎛️ Регистрация обработчиков...")
-            if "karma_manager" in modules:
-                setup_karma_handlers(dp, modules["karma_manager"])
-            else:
-                register_all_handlers(dp, modules)
-            print("  ✅ Обработчики зарегистрированы")
+            say("🎛️ Регистрация обработчиков...")
+            if ctx.karma_manager is not None:
+                setup_karma_handlers = lazy_attr(_karma_handlers_mod, "setup_karma_handlers")
+                if setup_karma_handlers is not None:
+                    setup_karma_handlers(dp, ctx.karma_manager)
+                    handlers_registered = True
+            # Модуль, который не импортируется, пропускаем и берем следующий
+            for module in _handler_mods:
+                if handlers_registered:
+                    break
+                register_all_handlers = lazy_attr(module, "register_all_handlers")
+                if register_all_handlers is not None:
+                    register_all_handlers(dp, ctx)
+                    handlers_registered = True
+
+        if handlers_registered:
+            say("  ✅ Обработчики зарегистрированы")
+            flush_banner()
         else:
-            print("❌ КРИТИЧЕСКАЯ ОШИБКА: Нет обработчиков!")
+            flush_banner()
+            print("❌ КРИТИЧЕСКАЯ ОШИБКА: Нет обработчиков!", file=sys.stderr)
             return
 
-        # Команды
-        await setup_bot_commands(bot)
+        # Уведомление админов (текст один для всех)
+        notify_text = (
+            f"🎭 <b>ENHANCED BOT v3.0 ЗАПУЩЕН!</b>\n\n"
+            f"<b>Бот:</b> @{bot_info.username}\n"
+            f"<b>Режим:</b> Базовый\n"
+            f"<b>Персонажи:</b> {'✅' if ctx.custom_personality_manager is not None else '❌'}\n"
+            f"<b>Карма:</b> {'✅' if ctx.karma_manager is not None else '❌'}\n\n"
+            f"<b>ГОТОВ К РАБОТЕ!</b>"
+        )
+
+        say("\n" + "=" * 50)
+        say("🎭 ENHANCED BOT v3.0 ЗАПУЩЕН УСПЕШНО!")
+        say("=" * 50)
+        say("\n💡 Для остановки: Ctrl+C")
+        flush_banner()
 
-        # Уведомление админов
-        for admin_id in config.bot.admin_ids:
+        # Запуск: работаем до сигнала остановки или падения поллинга
+        shutdown_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
             try:
-                await bot.send_message(
-                    admin_id,
-                    f"🎭 <b>ENHANCED BOT v3.0 ЗАПУЩЕН!</b>\n\n"
-                    f"<b>Бот:</b> @{bot_info.username}\n"
-                    f"<b>Режим:</b> Базовый\n"
-                    f"<b>Персонажи:</b> {'✅' if personality_system_available else '❌'}\n"
-                    f"<b>Карма:</b> {'✅' if karma_system_available else '❌'}\n\n"
-                    f"<b>ГОТОВ К РАБОТЕ!</b>"
-                )
-                print(f"  📤 Админ уведомлен: {admin_id}")
-            except Exception as e:
-                print(f"  ⚠️ Не удалось уведомить {admin_id}: {e}")
-
-        print("\n" + "=" * 50)
-        print("🎭 ENHANCED BOT v3.0 ЗАПУЩЕН УСПЕШНО!")
-        print("=" * 50)
-        print("\n💡 Для остановки: Ctrl+C")
-
-        # Запуск
-        await dp.start_polling(bot, skip_updates=True)
+                loop.add_signal_handler(sig, shutdown_event.set)
+            except NotImplementedError:
+                pass  # Windows: остается KeyboardInterrupt
+
+        # Команды и уведомление админов идут параллельно с первым getUpdates
+        startup_tasks += [
+            asyncio.create_task(setup_bot_commands(bot)),
+            asyncio.create_task(notify_admins(bot, config.bot.admin_ids, notify_text)),
+        ]
+        polling_task = asyncio.create_task(
+            dp.start_polling(bot, handle_signals=False)
+        )
+        shutdown_task = asyncio.create_task(shutdown_event.wait())
+        await asyncio.wait({polling_task, shutdown_task}, return_when=asyncio.FIRST_COMPLETED)
+
+        if shutdown_event.is_set():
+            print("\n⏸️ Остановка...")
+            polling_task.cancel()
+            await asyncio.gather(polling_task, return_exceptions=True)
+        else:
+            shutdown_task.cancel()
+            polling_task.result()  # пробрасываем ошибку поллинга
 
     except KeyboardInterrupt:
         print("\n⏸️ Остановка...")
     except Exception as e:
+        flush_banner()
         logger.error(f"💥 Критическая ошибка: {e}")
-        print(f"💥 ОШИБКА: {e}")
+        print(f"💥 ОШИБКА: {e}", file=sys.stderr)
     finally:
+        flush_banner()
         print("🛑 Остановка бота...")
-        try:
-            if "modules" in locals():
-                if "crypto_service" in modules:
-                    await modules["crypto_service"].close()
-                if "db" in modules:
-                    await modules["db"].close()
-            if "bot" in locals():
-                await bot.session.close()
-        except Exception:
-            pass
+        for result in await asyncio.gather(*startup_tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Ошибка стартовой задачи: {result}")
+        closers = [service.close() for service in (ctx.ai, ctx.crypto_service, ctx.db) if service is not None]
+        if bot is not None:
+            closers.append(bot.session.close())
+        for result in await asyncio.gather(*closers, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Ошибка при остановке: {result}")
+        if log_listener is not None:
+            log_listener.stop()
         print("✅ Бот остановлен")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
@@ -5,25 +5,42 @@ Enhanced Telegram Bot v3.0 - Production Ready
 """
 
 import asyncio
+import hashlib
 import logging
+import math
 import os
 import sys
-import json
-from typing import List, Dict, Any, Optional
+import tempfile
+import time
+from typing import List, Dict, Any, Final, FrozenSet, Optional, Tuple
 from datetime import datetime, timedelta
 from dataclasses import dataclass
+from functools import lru_cache
+from html.parser import HTMLParser
 import re
+from collections import Counter, deque
 
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command, CommandStart, StateFilter
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
-from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
+from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, MessageEntity
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
-import aiofiles
 import aiohttp
+import orjson
+import ahocorasick
+
+try:
+    from re import _parser as _sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse as _sre_parse
+
+try:
+    import re2  # google-re2: DFA, линейное время без катастрофического бэктрекинга
+except ImportError:
+    re2 = None
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -39,11 +56,440 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Статические тексты команд: собираются один раз при импорте
+_START_HTML: Final[str] = """🚀 <b>Добро пожаловать, {first_name}!</b>
+
+🤖 <b>Enhanced Telegram Bot v3.0 - Ultimate Edition</b>
+⭐ Самый продвинутый бот с ИИ и множеством функций
+
+📋 <b>Основные команды:</b>
+• /help - Полная справка
+• /about - Информация о боте  
+• /stats - Статистика использования
+• /ping - Проверить отклик
+• /ai [вопрос] - Задать вопрос ИИ
+
+⚡ <b>Система триггеров:</b>
+• /triggers - Управление триггерами
+• /trigger_add - Создать триггер
+• /trigger_list - Список триггеров
+
+🎯 <b>Умные функции:</b>
+• Интеллектуальные ответы на упоминания
+• Контекстное понимание диалога
+• Адаптивное поведение
+• Система модерации
+
+💡 Используйте /help для подробной информации!
+
+<i>Готов к работе! 🔥</i>"""
+
+_HELP_USER_HTML: Final[str] = """📚 <b>Справка Enhanced Bot v3.0</b>
+
+🎯 <b>Основные команды:</b>
+• /start - Приветствие и информация
+• /help - Показать эту справку
+• /about - Подробная информация о боте
+• /stats - Ваша статистика и статистика бота
+• /ping - Проверить отклик бота
+
+🤖 <b>ИИ функции:</b>
+• /ai [вопрос] - Задать вопрос искусственному интеллекту
+• Просто упомяните бота в сообщении
+• Отвечайте на сообщения бота для диалога
+
+⚡ <b>Система триггеров:</b>
+• /triggers - Интерактивное меню управления
+• /trigger_add [имя] [паттерн] [ответ] [тип] - Создать триггер
+• /trigger_list - Показать все ваши триггеры
+• /trigger_del [имя] - Удалить триггер
+
+🎭 <b>Типы триггеров:</b>
+• <code>contains</code> - содержит текст
+• <code>exact</code> - точное совпадение
+• <code>starts_with</code> - начинается с текста
+• <code>ends_with</code> - заканчивается текстом
+• <code>regex</code> - регулярное выражение"""
+
+_HELP_ADMIN_EXTRA_HTML: Final[str] = """
+
+👑 <b>Команды администратора:</b>
+• /admin - Панель администратора
+• /broadcast [текст] - Рассылка всем пользователям
+• /ban [user_id] [причина] - Забанить пользователя
+• /mute [user_id] [время] - Заглушить пользователя
+• /stats admin - Расширенная статистика"""
+
+_HELP_FOOTER_HTML: Final[str] = """
+
+💡 <b>Примеры использования:</b>
+<code>/trigger_add привет hello "Привет! 👋" contains</code>
+<code>/ai Объясни, что такое блокчейн</code>
+<code>/stats</code>
+
+🔥 <b>Особенности:</b>
+• Умные ответы на @упоминания
+• Контекстное понимание
+• Адаптивное поведение
+• Система модерации
+• Подробная аналитика
+
+❓ Нужна помощь? Напишите @killzloy12"""
+
+_ABOUT_HTML: Final[str] = """🚀 <b>Enhanced Telegram Bot v3.0</b>
+<i>Ultimate Edition</i>
+
+📝 <b>Описание:</b>
+Самый продвинутый Telegram бот с искусственным интеллектом, системой триггеров, расширенной модерацией и множеством уникальных функций.
+
+⚡ <b>Возможности:</b>
+• 🧠 AI помощник (GPT-4, Claude)
+• ⚡ Система пользовательских триггеров
+• 🛡️ Расширенная модерация
+• 🔒 Управление доступом
+• 📊 Детальная аналитика
+• 🎯 Интеллектуальные ответы
+• 📈 Адаптивное поведение
+
+📊 <b>Статистика:</b>
+• Обработано сообщений: {messages}
+• Уникальных пользователей: {users}
+• Время работы: {uptime}
+• Ошибок: {errors}
+
+👨‍💻 <b>Разработчик:</b> @killzloy12
+🔗 <b>GitHub:</b> github.com/killzloy12/anh-fork2
+📊 <b>Версия:</b> 3.0 (Production Ready)
+🔑 <b>Лицензия:</b> MIT
+
+⭐ <b>Поддержка проекта:</b>
+Поставьте звезду на GitHub и расскажите друзьям!
+
+💝 <i>Спасибо за использование Enhanced Bot!</i>"""
+
+
+class _EntityBuilder(HTMLParser):
+    """Переводит HTML-разметку Telegram в (текст, entities)."""
+
+    _TAGS = {'b': 'bold', 'i': 'italic', 'code': 'code'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.entities: List[MessageEntity] = []
+        self._offset = 0  # в UTF-16 единицах, как считает Telegram
+        self._open: List[Tuple[str, int]] = []
+
+    def handle_starttag(self, tag, attrs):
+        self._open.append((tag, self._offset))
+
+    def handle_endtag(self, tag):
+        open_tag, start = self._open.pop()
+        if open_tag == tag and tag in self._TAGS and self._offset > start:
+            self.entities.append(
+                MessageEntity(type=self._TAGS[tag], offset=start, length=self._offset - start)
+            )
+
+    def handle_data(self, data):
+        self.parts.append(data)
+        self._offset += len(data.encode('utf-16-le')) // 2
+
+
+def _html_to_entities(html: str) -> Tuple[str, List[MessageEntity]]:
+    """Однократно разбирает HTML: дальше сообщение уходит без parse_mode."""
+    builder = _EntityBuilder()
+    builder.feed(html)
+    builder.close()
+    return ''.join(builder.parts), builder.entities
+
+
+# /help без серверного разбора HTML: ключ - является ли пользователь админом
+_HELP_MESSAGES: Final[Dict[bool, Tuple[str, List[MessageEntity]]]] = {
+    False: _html_to_entities(_HELP_USER_HTML + _HELP_FOOTER_HTML),
+    True: _html_to_entities(_HELP_USER_HTML + _HELP_ADMIN_EXTRA_HTML + _HELP_FOOTER_HTML),
+}
+
+# Получатели /broadcast: переживают перезапуск
+SUBSCRIBERS_FILE: Final[str] = 'data/subscribers.json'
+
+# Ответ на ошибку команды: шаблон разобран заранее, подставляется только имя
+_COMMAND_ERROR_TEXT: Final = (
+    "❌ Произошла ошибка при выполнении команды /{cmd}\n"
+    "💡 Попробуйте позже или обратитесь к администратору"
+).format
+
+# Ключевые слова умных ответов -> категория ответа
+_SMART_KEYWORDS: Final[Dict[str, str]] = {
+    'привет': 'greeting', 'hello': 'greeting', 'hi': 'greeting', 'здарова': 'greeting',
+    'как дела': 'howdy', 'как поживаешь': 'howdy', 'что нового': 'howdy',
+    'спасибо': 'thanks', 'благодарю': 'thanks', 'thanks': 'thanks',
+    'бот': 'bot', 'робот': 'bot', 'bot': 'bot',
+}
+
+_KEYWORD_FIRST_CHARS: Final[frozenset] = frozenset(keyword[0] for keyword in _SMART_KEYWORDS) | {'?'}
+
+
+def _build_keyword_automaton() -> ahocorasick.Automaton:
+    """Один автомат на все ключевые слова: текст сканируется за один проход."""
+    automaton = ahocorasick.Automaton()
+    for keyword, category in _SMART_KEYWORDS.items():
+        automaton.add_word(keyword, (len(keyword), category))
+    automaton.make_automaton()
+    return automaton
+
+
+_SMART_AUTOMATON: Final = _build_keyword_automaton()
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+_SMART_RESPONSES: Final[Dict[str, str]] = {
+    'greeting': "👋 Привет, {first_name}! Как дела?",
+    'howdy': "😊 Отлично! Работаю, помогаю пользователям. А у вас как дела?",
+    'thanks': "😊 Пожалуйста! Рад помочь!",
+    'question': "🤔 Интересный вопрос! В полной версии с AI я дам более умный ответ.",
+    'bot': "🤖 Да, я Enhanced Bot v3.0! Чем могу помочь?",
+}
+
+
+@lru_cache(maxsize=4096)
+def _smart_response_kind(text: str) -> Optional[str]:
+    """Выбирает категорию умного ответа для нормализованного текста (с кэшем:
+    короткие фразы вроде "привет" повторяются постоянно)."""
+    # Категории всех ключевых слов, найденных целыми словами ("hi" в "this" не считается)
+    categories = set()
+    for end, (length, category) in _SMART_AUTOMATON.iter(text):
+        start = end - length + 1
+        if ((start == 0 or not _is_word_char(text[start - 1]))
+                and (end + 1 == len(text) or not _is_word_char(text[end + 1]))):
+            categories.add(category)
+
+    # Приоритет как у прежней цепочки проверок
+    for category in ('greeting', 'howdy', 'thanks'):
+        if category in categories:
+            return category
+    if '?' in text and len(text) > 10:
+        return 'question'
+    if 'bot' in categories:
+        return 'bot'
+    return None
+
+
+
+# Классы re2 - только ASCII: заменяем их Unicode-эквивалентами, как в re.
+# Значение - (замена вне [...], замена внутри [...]); None - в re2 не выразить
+_RE2_CLASS_SUBSTITUTES: Final[Dict[str, Tuple[Optional[str], Optional[str]]]] = {
+    'w': (r'[\p{L}\p{N}_]', r'\p{L}\p{N}_'),
+    'W': (r'[^\p{L}\p{N}_]', None),
+    'd': (r'\p{Nd}', r'\p{Nd}'),
+    'D': (r'\P{Nd}', r'\P{Nd}'),
+    's': (r'[\s\v\p{Z}]', r'\s\v\p{Z}'),
+    'S': (r'[^\s\v\p{Z}]', None),
+    'b': (None, r'\x08'),  # внутри [...] \b - это backspace
+    'B': (None, None),
+}
+
+
+def _to_re2_pattern(pattern: str) -> Optional[str]:
+    """Переводит паттерн re в эквивалент для re2; None, если перевести нельзя (\\b, \\B)."""
+    parts = []
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            if escaped in _RE2_CLASS_SUBSTITUTES:
+                substitute = _RE2_CLASS_SUBSTITUTES[escaped][in_class]
+                if substitute is None:
+                    return None
+                parts.append(substitute)
+            else:
+                parts.append(pattern[i:i + 2])
+            i += 2
+            continue
+        if not in_class and char == '[':
+            j = i + 1
+            if j < len(pattern) and pattern[j] == '^':
+                j += 1
+            if j < len(pattern) and pattern[j] == ']':
+                j += 1  # ']' сразу после '[' - обычный символ
+            parts.append(pattern[i:j])
+            in_class = True
+            i = j
+            continue
+        if in_class and char == ']':
+            in_class = False
+        parts.append(char)
+        i += 1
+    return ''.join(parts)
+
+
+def _compile_trigger_regex(pattern: str):
+    """Компилирует regex триггера: через re2, если он есть и принимает паттерн."""
+    if re2 is not None:
+        re2_pattern = _to_re2_pattern(pattern)
+        if re2_pattern is not None:
+            # У google-re2 нет флагов re.*: регистр и прочее задаются через Options
+            options = re2.Options()
+            options.case_sensitive = False
+            options.log_errors = False
+            try:
+                return re2.compile(re2_pattern, options)
+            except Exception:
+                pass  # обратные ссылки, lookaround и т.п. - только в стандартном re
+    return re.compile(pattern, re.IGNORECASE)
+
+
+# Ограничения regex-триггеров: stdlib re держит GIL весь поиск, поток от бэктрекинга не спасает.
+# Текст не обрезается (иначе $ совпал бы на границе); re2 линеен и проверяет сообщение целиком,
+# паттерны на stdlib re на более длинных сообщениях пропускаются
+_MAX_REGEX_PATTERN_LENGTH: Final[int] = 200
+_MAX_REGEX_TEXT_LENGTH: Final[int] = 1024
+
+
+_REPEAT_OPS = frozenset(
+    getattr(_sre_parse, name) for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+    if hasattr(_sre_parse, name)
+)
+
+
+def _has_nested_repeat(pattern: str) -> bool:
+    """Есть ли повторение внутри неограниченного повторения - (a+)+, (\\w*)*:
+    главный источник экспоненциального бэктрекинга в stdlib re."""
+    def children(value):
+        if isinstance(value, _sre_parse.SubPattern):
+            yield value
+        elif isinstance(value, (tuple, list)):
+            for item in value:
+                yield from children(item)
+
+    def walk(subpattern, in_unbounded: bool) -> bool:
+        for op, value in subpattern:
+            if op in _REPEAT_OPS:
+                _, high, body = value
+                if in_unbounded and high > 1:
+                    return True
+                if walk(body, in_unbounded or high == _sre_parse.MAXREPEAT):
+                    return True
+            elif any(walk(child, in_unbounded) for child in children(value)):
+                return True
+        return False
+
+    return walk(_sre_parse.parse(pattern), False)
+
+
+def _validate_trigger_regex(pattern: str) -> Optional[str]:
+    """Проверяет regex нового триггера; возвращает текст ошибки или None."""
+    if len(pattern) > _MAX_REGEX_PATTERN_LENGTH:
+        return f"❌ Регулярное выражение длиннее {_MAX_REGEX_PATTERN_LENGTH} символов"
+    try:
+        re.compile(pattern)
+    except re.error:
+        return "❌ Неверное регулярное выражение"
+    re2_pattern = _to_re2_pattern(pattern) if re2 is not None else None
+    if re2_pattern is not None:
+        # Все, что понимает re2, исполнит он: линейное время поиска
+        options = re2.Options()
+        options.log_errors = False
+        try:
+            re2.compile(re2_pattern, options)
+        except Exception:
+            return "❌ Обратные ссылки и lookaround в триггерах не поддерживаются"
+    elif _has_nested_repeat(pattern):
+        # \b, \B, [\W] (или нет re2) - паттерн исполнит stdlib re, без вложенных квантификаторов
+        return "❌ Вложенные квантификаторы вида (a+)+ в триггерах не поддерживаются"
+    return None
+
+
+def _scan_regex_triggers(text: str, union, regex_triggers: List[Tuple[int, str, Any, bool]],
+                         stop_order: int) -> Optional[str]:
+    """Первый в порядке создания regex-триггер, совпавший с текстом и созданный
+    раньше stop_order."""
+    long_text = len(text) > _MAX_REGEX_TEXT_LENGTH
+    # Объединенный regex - префильтр: не совпал он - не совпал ни один из входящих в него
+    union_hit = None
+    for order, name, compiled, in_union in regex_triggers:
+        if order >= stop_order:
+            break
+        if long_text and isinstance(compiled, re.Pattern):
+            continue  # бэктрекинг на длинном тексте - не рискуем
+        if in_union:
+            if union_hit is None:
+                union_hit = union.search(text) is not None
+            if not union_hit:
+                continue
+        if compiled.search(text):
+            return name
+    return None
+
+
+def _write_file_atomic(path: str, data: bytes):
+    """Атомарно заменяет файл: уникальный временный файл рядом, fsync, os.replace.
+    Блокирующая функция - вызывается через asyncio.to_thread."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    # Переименование переживает сбой питания только после fsync каталога (POSIX)
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class HyperLogLog:
+    """Оценка числа уникальных значений: 2**p однобайтовых регистров, погрешность ~1.04/sqrt(2**p).
+    Своя реализация: datasketch тянет за собой numpy и scipy."""
+    __slots__ = ('_p', '_m', '_registers')
+
+    def __init__(self, p: int = 14):
+        self._p = p
+        self._m = 1 << p
+        self._registers = bytearray(self._m)
+
+    def update(self, value: bytes):
+        """Учитывает значение."""
+        x = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), 'big')
+        index = x >> (64 - self._p)
+        rest = x & ((1 << (64 - self._p)) - 1)
+        # Позиция первой единицы в оставшихся битах
+        rank = (64 - self._p) - rest.bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def count(self) -> float:
+        """Оценка числа уникальных значений."""
+        m = self._m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self._registers)
+        zeros = self._registers.count(0)
+        # На малых значениях точнее линейный подсчет по пустым регистрам
+        if estimate <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return estimate
+
+
 @dataclass
 class BotConfig:
     """Конфигурация бота с валидацией."""
     bot_token: str
-    admin_ids: List[int]
+    admin_ids: FrozenSet[int]
     openai_api_key: Optional[str] = None
     smart_responses: bool = True
     triggers_enabled: bool = True
@@ -55,6 +501,15 @@ class BotConfig:
             raise ValueError("❌ BOT_TOKEN обязателен")
         if not self.admin_ids:
             raise ValueError("❌ Необходимо указать хотя бы одного администратора")
+        # Проверка прав - один хэш-поиск вместо прохода по списку
+        self.admin_ids = frozenset(self.admin_ids)
+
+@dataclass(slots=True)
+class MsgCtx:
+    """Текст сообщения, нормализованный один раз на все проверки."""
+    message: Message
+    raw: str
+    lower: str
 
 class TriggerStates(StatesGroup):
     """Состояния для создания триггеров."""
@@ -68,29 +523,53 @@ class EnhancedTelegramBot:
 
     def __init__(self):
         self.config = self._load_config()
+        self._admin_ids = self.config.admin_ids
         self.bot = Bot(token=self.config.bot_token)
         self.dp = Dispatcher(storage=MemoryStorage())
 
         # Статистика
         self.stats = {
             'messages_processed': 0,
-            'users_count': set(),
+            # HyperLogLog: ~16 КБ на любое число пользователей, погрешность ~1%
+            'users_hll': HyperLogLog(p=14),
             'start_time': datetime.now(),
-            'commands_used': {},
             'errors_count': 0
         }
 
         # Система триггеров
         self.triggers = self._load_triggers()
+        self._rebuild_trigger_index()
+        self._triggers_dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+        # Сохранения идут по одному: иначе старый снимок может перезаписать новый
+        self._save_lock = asyncio.Lock()
+
+        # Rate limiting: user_id -> (счетчик прошлого окна, счетчик текущего окна, номер окна)
+        self.rate_limits: Dict[int, Tuple[int, int, int]] = {}
+        self._gc_task: Optional[asyncio.Task] = None
 
-        # Rate limiting
-        self.rate_limits = {}
+        # Использование команд: кольцо из 60 минутных корзин (последний час)
+        self._cmd_buckets: deque = deque([Counter() for _ in range(60)], maxlen=60)
+        self._cmd_rotate_task: Optional[asyncio.Task] = None
+
+        # Рассылка: получатели - пользователи, нажавшие /start (хранятся на диске)
+        self.subscribers: set = self._load_subscribers()
+        self._subscribers_dirty = False
+        self._broadcast_semaphore = asyncio.Semaphore(28)
+        self._broadcast_next_slot = 0.0
+
+        # Сильные ссылки на фоновые задачи, иначе GC может их собрать
+        self._background_tasks: set = set()
 
         # Регистрируем обработчики
         self._register_handlers()
 
         logger.info("🚀 Enhanced Telegram Bot v3.0 инициализирован")
 
+    def _unique_users(self) -> int:
+        """Оценка числа уникальных пользователей."""
+        return int(self.stats['users_hll'].count())
+
     def _load_config(self) -> BotConfig:
         """Загружает и валидирует конфигурацию."""
         bot_token = os.getenv('BOT_TOKEN')
@@ -110,14 +589,35 @@ class EnhancedTelegramBot:
             auto_moderation=os.getenv('AUTO_MODERATION', 'true').lower() == 'true'
         )
 
+    @staticmethod
+    def _prepare_trigger(trigger: Dict[str, Any]) -> Dict[str, Any]:
+        """Кэширует паттерн в нижнем регистре и скомпилированный regex."""
+        trigger['type'] = sys.intern(trigger['type'])
+        trigger['_pattern_lower'] = trigger['pattern'].lower()
+        if trigger['type'] == 'regex':
+            try:
+                trigger['_re'] = _compile_trigger_regex(trigger['pattern'])
+            except re.error:
+                trigger['_re'] = None
+        return trigger
+
     def _load_triggers(self) -> Dict[str, Any]:
         """Загружает пользовательские триггеры."""
+        # Пока файл не прочитан успешно, сохранение его не перезаписывает
+        self._triggers_load_failed = False
         try:
             if os.path.exists('triggers.json'):
-                with open('triggers.json', 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open('triggers.json', 'rb') as f:
+                    triggers = orjson.loads(f.read())
+                # Имена из JSON интернируем, чтобы они совпадали с ключами индекса по ссылке
+                triggers['global'] = {
+                    sys.intern(name): self._prepare_trigger(trigger)
+                    for name, trigger in triggers.get('global', {}).items()
+                }
+                return triggers
         except Exception as e:
-            logger.warning(f"Ошибка загрузки триггеров: {e}")
+            logger.error("Ошибка загрузки триггеров, сохранение отключено: %s", e)
+            self._triggers_load_failed = True
 
         return {
             'global': {},
@@ -125,33 +625,176 @@ class EnhancedTelegramBot:
             'stats': {}
         }
 
+    def _rebuild_trigger_index(self):
+        """Перестраивает индекс триггеров: автомат Ахо-Корасик для подстрок,
+        словарь для exact и объединенный regex."""
+        self._trigger_order: Dict[str, int] = {}
+        self._triggers_by_owner: Dict[int, List[str]] = {}
+        self._exact_triggers: Dict[str, str] = {}
+        # Regex в порядке создания: (порядок, имя, regex, входит ли в объединенный префильтр)
+        self._regex_triggers: List[Tuple[int, str, Any, bool]] = []
+        union_patterns: List[str] = []
+        automaton = ahocorasick.Automaton()
+
+        for order, (name, trigger) in enumerate(self.triggers.get('global', {}).items()):
+            self._trigger_order[name] = order
+            self._triggers_by_owner.setdefault(trigger.get('created_by'), []).append(name)
+            pattern_lower = trigger['_pattern_lower']
+            trigger_type = trigger['type']
+
+            if trigger_type == 'exact':
+                self._exact_triggers.setdefault(pattern_lower, name)
+            elif trigger_type == 'regex':
+                compiled = trigger['_re']
+                if compiled is None:
+                    continue
+                # В объединение не входят regex с группами (сдвинулась бы нумерация \1)
+                # и исполняемые stdlib re (бэктрекинг не должен попасть в общий префильтр)
+                in_union = not compiled.groups and (re2 is None or not isinstance(compiled, re.Pattern))
+                self._regex_triggers.append((order, name, compiled, in_union))
+                if in_union:
+                    union_patterns.append(trigger['pattern'])
+            elif pattern_lower:
+                # Один паттерн может принадлежать нескольким триггерам
+                entries = automaton.get(pattern_lower, [])
+                entries.append((name, trigger_type, len(pattern_lower)))
+                automaton.add_word(pattern_lower, entries)
+
+        if len(automaton):
+            automaton.make_automaton()
+            self._automaton = automaton
+        else:
+            self._automaton = None
+
+        # Regex без групп одной альтернативой: один поиск отсекает сообщения без совпадений
+        self._regex_union = None
+        if union_patterns:
+            try:
+                self._regex_union = _compile_trigger_regex(
+                    "|".join(f"(?:{pattern})" for pattern in union_patterns)
+                )
+            except re.error:
+                # Несовместимые флаги и т.п. - проверяем по одному
+                self._regex_triggers = [
+                    (order, name, compiled, False)
+                    for order, name, compiled, _ in self._regex_triggers
+                ]
+
+    def _serializable_triggers(self) -> Dict[str, Any]:
+        """Триггеры без служебных `_`-полей (формат файла не меняется)."""
+        data = dict(self.triggers)
+        data['global'] = {
+            name: {key: value for key, value in trigger.items() if not key.startswith('_')}
+            for name, trigger in self.triggers.get('global', {}).items()
+        }
+        return data
+
     async def _save_triggers(self):
         """Сохраняет триггеры в файл."""
+        if self._triggers_load_failed:
+            logger.error("triggers.json не загрузился при запуске - не перезаписываем его")
+            return
         try:
-            async with aiofiles.open('triggers.json', 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(self.triggers, ensure_ascii=False, indent=2))
+            async with self._save_lock:
+                # Снимок берется под блокировкой: на диск попадает самое свежее состояние
+                data = orjson.dumps(
+                    self._serializable_triggers(),
+                    option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+                )
+                # Временный файл и атомарная подмена: при падении файл не обрежется
+                await asyncio.to_thread(_write_file_atomic, 'triggers.json', data)
         except Exception as e:
-            logger.error(f"Ошибка сохранения триггеров: {e}")
-
-    def _is_rate_limited(self, user_id: int, limit: int = 30, window: int = 60) -> bool:
-        """Проверяет rate limiting для пользователя."""
-        now = datetime.now()
+            logger.error("Ошибка сохранения триггеров: %s", e)
 
-        if user_id not in self.rate_limits:
-            self.rate_limits[user_id] = []
+    def _load_subscribers(self) -> set:
+        """Загружает получателей рассылки."""
+        try:
+            with open(SUBSCRIBERS_FILE, 'rb') as f:
+                return set(orjson.loads(f.read()))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Ошибка загрузки подписчиков: %s", e)
+        return set()
 
-        # Очищаем старые запросы
-        self.rate_limits[user_id] = [
-            timestamp for timestamp in self.rate_limits[user_id]
-            if (now - timestamp).total_seconds() < window
-        ]
+    async def _save_subscribers(self):
+        """Сохраняет получателей рассылки в файл."""
+        try:
+            data = orjson.dumps(sorted(self.subscribers))
+            os.makedirs(os.path.dirname(SUBSCRIBERS_FILE), exist_ok=True)
+            await asyncio.to_thread(_write_file_atomic, SUBSCRIBERS_FILE, data)
+        except Exception as e:
+            logger.error("Ошибка сохранения подписчиков: %s", e)
 
-        if len(self.rate_limits[user_id]) >= limit:
+    def _is_rate_limited(self, user_id: int, limit: int = 30, window: int = 60) -> bool:
+        """Проверяет rate limiting для пользователя (скользящее окно на двух счетчиках)."""
+        now = time.monotonic()
+        current = int(now // window)
+        prev_count, curr_count, window_id = self.rate_limits.get(user_id, (0, 0, current))
+
+        # Сдвигаем окна: прошлое окно устарело целиком или стало предыдущим
+        if window_id == current - 1:
+            prev_count, curr_count = curr_count, 0
+        elif window_id != current:
+            prev_count, curr_count = 0, 0
+
+        # Доля прошлого окна, которая еще попадает в скользящее окно
+        estimated = prev_count * (1 - (now % window) / window) + curr_count
+        if estimated >= limit:
+            self.rate_limits[user_id] = (prev_count, curr_count, current)
             return True
 
-        self.rate_limits[user_id].append(now)
+        self.rate_limits[user_id] = (prev_count, curr_count + 1, current)
         return False
 
+    def _spawn(self, coro) -> asyncio.Task:
+        """Запускает корутину в фоне, удерживая ссылку до завершения."""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_background_done)
+        return task
+
+    def _on_background_done(self, task: asyncio.Task):
+        """Освобождает ссылку на задачу и логирует ее ошибку."""
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error("Ошибка фоновой задачи: %s", task.exception())
+
+    def _track_command(self, command: str):
+        """Учитывает команду в текущей минутной корзине."""
+        self._cmd_buckets[-1][command] += 1
+
+    def _recent_commands(self) -> Counter:
+        """Использование команд за последний час."""
+        return sum(self._cmd_buckets, Counter())
+
+    async def _rotate_command_buckets(self, interval: int = 60):
+        """Раз в минуту открывает новую корзину, самая старая вытесняется."""
+        while True:
+            await asyncio.sleep(interval)
+            self._cmd_buckets.append(Counter())
+
+    async def _rate_limit_gc(self, window: int = 60, interval: int = 300):
+        """Периодически удаляет записи rate limiting старше двух окон."""
+        while True:
+            await asyncio.sleep(interval)
+            current = int(time.monotonic() // window)
+            self.rate_limits = {
+                user_id: entry for user_id, entry in self.rate_limits.items()
+                if entry[2] >= current - 1
+            }
+
+    async def _trigger_flush_loop(self, interval: int = 30):
+        """Периодически сохраняет счетчики использования триггеров и новых подписчиков."""
+        while True:
+            await asyncio.sleep(interval)
+            if self._triggers_dirty:
+                self._triggers_dirty = False
+                await self._save_triggers()
+            if self._subscribers_dirty:
+                self._subscribers_dirty = False
+                await self._save_subscribers()
+
     def _register_handlers(self):
         """Регистрирует все обработчики."""
 
@@ -188,6 +831,15 @@ class EnhancedTelegramBot:
         # Обработчик всех сообщений
         self.dp.message()(self._handle_all_messages)
 
+        # Флаги функций не меняются после запуска: цепочку ответчиков собираем один раз,
+        # чтобы не проверять конфигурацию на каждом сообщении
+        self._message_responders = tuple(
+            responder for enabled, responder in (
+                (self.config.triggers_enabled, self._check_triggers),
+                (self.config.smart_responses, self._get_smart_response),
+            ) if enabled
+        )
+
         # Обработчик ошибок
         self.dp.error()(self._handle_error)
 
@@ -199,41 +851,19 @@ class EnhancedTelegramBot:
                 return
 
             user = message.from_user
-            self.stats['users_count'].add(user.id)
-
-            welcome_text = f"""🚀 <b>Добро пожаловать, {user.first_name}!</b>
-
-🤖 <b>Enhanced Telegram Bot v3.0 - Ultimate Edition</b>
-⭐ Самый продвинутый бот с ИИ и множеством функций
-
-📋 <b>Основные команды:</b>
-• /help - Полная справка
-• /about - Информация о боте  
-• /stats - Статистика использования
-• /ping - Проверить отклик
-• /ai [вопрос] - Задать вопрос ИИ
-
-⚡ <b>Система триггеров:</b>
-• /triggers - Управление триггерами
-• /trigger_add - Создать триггер
-• /trigger_list - Список триггеров
+            self.stats['users_hll'].update(str(user.id).encode())
+            if user.id not in self.subscribers:
+                self.subscribers.add(user.id)
+                self._subscribers_dirty = True
 
-🎯 <b>Умные функции:</b>
-• Интеллектуальные ответы на упоминания
-• Контекстное понимание диалога
-• Адаптивное поведение
-• Система модерации
-
-💡 Используйте /help для подробной информации!
-
-<i>Готов к работе! 🔥</i>"""
+            welcome_text = _START_HTML.format(first_name=user.first_name)
 
             await message.answer(welcome_text, parse_mode="HTML")
 
             # Обновляем статистику
-            self.stats['commands_used']['start'] = self.stats['commands_used'].get('start', 0) + 1
+            self._track_command('start')
 
-            logger.info(f"👤 Новый пользователь: {user.first_name} (@{user.username}) [{user.id}]")
+            logger.info("👤 Новый пользователь: %s (@%s) [%s]", user.first_name, user.username, user.id)
 
         except Exception as e:
             await self._handle_command_error(message, e, "start")
@@ -242,63 +872,12 @@ class EnhancedTelegramBot:
         """Обработчик команды /help."""
         try:
             user_id = message.from_user.id
-            is_admin = user_id in self.config.admin_ids
-
-            help_text = """📚 <b>Справка Enhanced Bot v3.0</b>
-
-🎯 <b>Основные команды:</b>
-• /start - Приветствие и информация
-• /help - Показать эту справку
-• /about - Подробная информация о боте
-• /stats - Ваша статистика и статистика бота
-• /ping - Проверить отклик бота
-
-🤖 <b>ИИ функции:</b>
-• /ai [вопрос] - Задать вопрос искусственному интеллекту
-• Просто упомяните бота в сообщении
-• Отвечайте на сообщения бота для диалога
-
-⚡ <b>Система триггеров:</b>
-• /triggers - Интерактивное меню управления
-• /trigger_add [имя] [паттерн] [ответ] [тип] - Создать триггер
-• /trigger_list - Показать все ваши триггеры
-• /trigger_del [имя] - Удалить триггер
-
-🎭 <b>Типы триггеров:</b>
-• <code>contains</code> - содержит текст
-• <code>exact</code> - точное совпадение
-• <code>starts_with</code> - начинается с текста
-• <code>ends_with</code> - заканчивается текстом
-• <code>regex</code> - регулярное выражение"""
-
-            if is_admin:
-                help_text += """
-
-👑 <b>Команды администратора:</b>
-• /admin - Панель администратора
-• /broadcast [текст] - Рассылка всем пользователям
-• /ban [user_id] [причина] - Забанить пользователя
-• /mute [user_id] [время] - Заглушить пользователя
-• /stats admin - Расширенная статистика"""
-
-            help_text += """
-
-💡 <b>Примеры использования:</b>
-<code>/trigger_add привет hello "Привет! 👋" contains</code>
-<code>/ai Объясни, что такое блокчейн</code>
-<code>/stats</code>
-
-🔥 <b>Особенности:</b>
-• Умные ответы на @упоминания
-• Контекстное понимание
-• Адаптивное поведение
-• Система модерации
-• Подробная аналитика
+            is_admin = user_id in self._admin_ids
 
-❓ Нужна помощь? Напишите @killzloy12"""
+            help_text, help_entities = _HELP_MESSAGES[is_admin]
 
-            await message.answer(help_text, parse_mode="HTML")
-            self.stats['commands_used']['help'] = self.stats['commands_used'].get('help', 0) + 1
+            await message.answer(help_text, entities=help_entities, parse_mode=None)
+            self._track_command('help')
 
         except Exception as e:
             await self._handle_command_error(message, e, "help")
@@ -309,39 +888,15 @@ class EnhancedTelegramBot:
             uptime = datetime.now() - self.stats['start_time']
             uptime_str = f"{uptime.days}д {uptime.seconds//3600}ч {(uptime.seconds//60)%60}м"
 
-            about_text = f"""🚀 <b>Enhanced Telegram Bot v3.0</b>
-<i>Ultimate Edition</i>
-
-📝 <b>Описание:</b>
-Самый продвинутый Telegram бот с искусственным интеллектом, системой триггеров, расширенной модерацией и множеством уникальных функций.
-
-⚡ <b>Возможности:</b>
-• 🧠 AI помощник (GPT-4, Claude)
-• ⚡ Система пользовательских триггеров
-• 🛡️ Расширенная модерация
-• 🔒 Управление доступом
-• 📊 Детальная аналитика
-• 🎯 Интеллектуальные ответы
-• 📈 Адаптивное поведение
-
-📊 <b>Статистика:</b>
-• Обработано сообщений: {self.stats['messages_processed']}
-• Уникальных пользователей: {len(self.stats['users_count'])}
-• Время работы: {uptime_str}
-• Ошибок: {self.stats['errors_count']}
-
-👨‍💻 <b>Разработчик:</b> @killzloy12
-🔗 <b>GitHub:</b> github.com/killzloy12/anh-fork2
-📊 <b>Версия:</b> 3.0 (Production Ready)
-🔑 <b>Лицензия:</b> MIT
-
-⭐ <b>Поддержка проекта:</b>
-Поставьте звезду на GitHub и расскажите друзьям!
-
-💝 <i>Спасибо за использование Enhanced Bot!</i>"""
+            about_text = _ABOUT_HTML.format(
+                messages=self.stats['messages_processed'],
+                users=self._unique_users(),
+                uptime=uptime_str,
+                errors=self.stats['errors_count']
+            )
 
             await message.answer(about_text, parse_mode="HTML")
-            self.stats['commands_used']['about'] = self.stats['commands_used'].get('about', 0) + 1
+            self._track_command('about')
 
         except Exception as e:
             await self._handle_command_error(message, e, "about")
@@ -350,11 +905,13 @@ class EnhancedTelegramBot:
         """Обработчик команды /stats."""
         try:
             user_id = message.from_user.id
-            is_admin = user_id in self.config.admin_ids
+            is_admin = user_id in self._admin_ids
 
             uptime = datetime.now() - self.stats['start_time']
             uptime_str = f"{uptime.days}д {uptime.seconds//3600}ч {(uptime.seconds//60)%60}м"
 
+            recent_commands = self._recent_commands()
+
             if is_admin and len(message.text.split()) > 1 and message.text.split()[1] == 'admin':
                 # Расширенная админская статистика
                 stats_text = f"""📊 <b>Административная статистика</b>
@@ -366,13 +923,13 @@ class EnhancedTelegramBot:
 
 💬 <b>Активность:</b>
 • Сообщений обработано: {self.stats['messages_processed']}
-• Уникальных пользователей: {len(self.stats['users_count'])}
+• Уникальных пользователей: {self._unique_users()}
 • Ошибок: {self.stats['errors_count']}
-• Команд использовано: {sum(self.stats['commands_used'].values())}
+• Команд за час: {sum(recent_commands.values())}
 
-⚡ <b>Популярные команды:</b>"""
+⚡ <b>Популярные команды за час:</b>"""
 
-                for cmd, count in sorted(self.stats['commands_used'].items(), key=lambda x: x[1], reverse=True)[:5]:
+                for cmd, count in recent_commands.most_common(5):
                     stats_text += f"\n• /{cmd}: {count} раз"
 
                 stats_text += f"""
@@ -393,7 +950,7 @@ class EnhancedTelegramBot:
 
 🤖 <b>Статистика бота:</b>
 • 💬 Обработано сообщений: {self.stats['messages_processed']:,}
-• 👥 Уникальных пользователей: {len(self.stats['users_count']):,}
+• 👥 Уникальных пользователей: {self._unique_users():,}
 • ⏱️ Время работы: {uptime_str}
 • 🔥 Статус: Онлайн
 
@@ -403,13 +960,13 @@ class EnhancedTelegramBot:
 • AI помощник: {'✅' if self.config.openai_api_key else '❌'}
 • Автомодерация: {'✅' if self.config.auto_moderation else '❌'}
 
-📈 <b>Использование команд:</b>"""
+📈 <b>Использование команд за час:</b>"""
 
-                for cmd, count in list(self.stats['commands_used'].items())[:3]:
+                for cmd, count in recent_commands.most_common(3):
                     stats_text += f"\n• /{cmd}: {count} раз"
 
             await message.answer(stats_text, parse_mode="HTML")
-            self.stats['commands_used']['stats'] = self.stats['commands_used'].get('stats', 0) + 1
+            self._track_command('stats')
 
         except Exception as e:
             await self._handle_command_error(message, e, "stats")
@@ -417,26 +974,25 @@ class EnhancedTelegramBot:
     async def _handle_ping(self, message: Message):
         """Обработчик команды /ping."""
         try:
-            start_time = datetime.now()
+            start_time = time.perf_counter()
             sent_message = await message.answer("🏓 Понг! Измеряю задержку...")
+            latency = (time.perf_counter() - start_time) * 1000
 
-            end_time = datetime.now()
-            latency = (end_time - start_time).total_seconds() * 1000
-
-            await sent_message.edit_text(
+            # Редактирование уходит в фон: обработчик не ждет второй запрос
+            self._spawn(sent_message.edit_text(
                 f"🏓 <b>Понг!</b>\n\n"
                 f"⚡ Задержка: {latency:.1f}ms\n"
                 f"✅ Бот работает исправно\n"
                 f"📡 Соединение стабильно",
                 parse_mode="HTML"
-            )
+            ))
 
-            self.stats['commands_used']['ping'] = self.stats['commands_used'].get('ping', 0) + 1
+            self._track_command('ping')
 
         except Exception as e:
             await self._handle_command_error(message, e, "ping")
 
-    async def _handle_ai(self, message: Message):
+    async def _handle_ai(self, message: Message, command: CommandObject):
         """Обработчик AI команды."""
         try:
             if not self.config.openai_api_key:
@@ -448,7 +1004,7 @@ class EnhancedTelegramBot:
                 )
                 return
 
-            query = message.text[4:].strip()  # Убираем "/ai "
+            query = (command.args or "").strip()
             if not query:
                 await message.answer(
                     "💡 <b>Использование:</b> <code>/ai ваш вопрос</code>\n\n"
@@ -471,12 +1027,12 @@ class EnhancedTelegramBot:
                          f"💡 Для полной AI интеграции нужен API ключ OpenAI."
 
             await thinking_msg.edit_text(ai_response, parse_mode="HTML")
-            self.stats['commands_used']['ai'] = self.stats['commands_used'].get('ai', 0) + 1
+            self._track_command('ai')
 
         except Exception as e:
             await self._handle_command_error(message, e, "ai")
 
-    async def _handle_trigger_add(self, message: Message):
+    async def _handle_trigger_add(self, message: Message, command: CommandObject):
         """Обработчик добавления триггера."""
         try:
             if not self.config.triggers_enabled:
@@ -484,10 +1040,10 @@ class EnhancedTelegramBot:
                 return
 
             user_id = message.from_user.id
-            is_admin = user_id in self.config.admin_ids
+            is_admin = user_id in self._admin_ids
 
             # Проверяем лимиты
-            user_triggers = len([t for t in self.triggers.get('global', {}).values() if t.get('created_by') == user_id])
+            user_triggers = len(self._triggers_by_owner.get(user_id, ()))
             max_triggers = 100 if is_admin else self.config.max_triggers_per_user
 
             if user_triggers >= max_triggers:
@@ -495,7 +1051,7 @@ class EnhancedTelegramBot:
                 return
 
             # Парсим аргументы
-            args = message.text.split()[1:]  # Убираем /trigger_add
+            args = (command.args or "").split()
 
             if len(args) < 4:
                 await message.answer(
@@ -513,7 +1069,7 @@ class EnhancedTelegramBot:
                 )
                 return
 
-            name, pattern, response, trigger_type = args[0], args[1], args[2], args[3]
+            name, pattern, response, trigger_type = sys.intern(args[0]), args[1], args[2], args[3]
 
             # Валидация типа триггера
             valid_types = ['contains', 'exact', 'starts_with', 'ends_with', 'regex']
@@ -523,25 +1079,25 @@ class EnhancedTelegramBot:
 
             # Проверяем regex
             if trigger_type == 'regex':
-                try:
-                    re.compile(pattern)
-                except re.error:
-                    await message.answer("❌ Неверное регулярное выражение")
+                error_text = _validate_trigger_regex(pattern)
+                if error_text:
+                    await message.answer(error_text)
                     return
 
             # Сохраняем триггер
             if 'global' not in self.triggers:
                 self.triggers['global'] = {}
 
-            self.triggers['global'][name] = {
+            self.triggers['global'][name] = self._prepare_trigger({
                 'pattern': pattern,
                 'response': response,
                 'type': trigger_type,
                 'created_by': user_id,
                 'created_at': datetime.now().isoformat(),
                 'usage_count': 0
-            }
+            })
 
+            self._rebuild_trigger_index()
             await self._save_triggers()
 
             await message.answer(
@@ -553,7 +1109,7 @@ class EnhancedTelegramBot:
                 parse_mode="HTML"
             )
 
-            self.stats['commands_used']['trigger_add'] = self.stats['commands_used'].get('trigger_add', 0) + 1
+            self._track_command('trigger_add')
 
         except Exception as e:
             await self._handle_command_error(message, e, "trigger_add")
@@ -562,9 +1118,9 @@ class EnhancedTelegramBot:
         """Показать список триггеров пользователя."""
         try:
             user_id = message.from_user.id
+            global_triggers = self.triggers.get('global', {})
             user_triggers = {
-                name: trigger for name, trigger in self.triggers.get('global', {}).items()
-                if trigger.get('created_by') == user_id
+                name: global_triggers[name] for name in self._triggers_by_owner.get(user_id, ())
             }
 
             if not user_triggers:
@@ -586,15 +1142,15 @@ class EnhancedTelegramBot:
                 triggers_text += f"   📊 Использований: {trigger.get('usage_count', 0)}\n\n"
 
             await message.answer(triggers_text, parse_mode="HTML")
-            self.stats['commands_used']['trigger_list'] = self.stats['commands_used'].get('trigger_list', 0) + 1
+            self._track_command('trigger_list')
 
         except Exception as e:
             await self._handle_command_error(message, e, "trigger_list")
 
-    async def _handle_trigger_delete(self, message: Message):
+    async def _handle_trigger_delete(self, message: Message, command: CommandObject):
         """Удалить триггер."""
         try:
-            args = message.text.split()[1:]
+            args = (command.args or "").split()
             if not args:
                 await message.answer("💡 Использование: <code>/trigger_del [имя триггера]</code>", parse_mode="HTML")
                 return
@@ -607,15 +1163,16 @@ class EnhancedTelegramBot:
                 return
 
             trigger = self.triggers['global'][trigger_name]
-            if trigger.get('created_by') != user_id and user_id not in self.config.admin_ids:
+            if trigger.get('created_by') != user_id and user_id not in self._admin_ids:
                 await message.answer("❌ Вы можете удалять только свои триггеры")
                 return
 
             del self.triggers['global'][trigger_name]
+            self._rebuild_trigger_index()
             await self._save_triggers()
 
             await message.answer(f"✅ Триггер <code>{trigger_name}</code> удален", parse_mode="HTML")
-            self.stats['commands_used']['trigger_del'] = self.stats['commands_used'].get('trigger_del', 0) + 1
+            self._track_command('trigger_del')
 
         except Exception as e:
             await self._handle_command_error(message, e, "trigger_del")
@@ -624,8 +1181,8 @@ class EnhancedTelegramBot:
         """Интерактивное меню управления триггерами."""
         try:
             user_id = message.from_user.id
-            user_triggers = len([t for t in self.triggers.get('global', {}).values() if t.get('created_by') == user_id])
-            is_admin = user_id in self.config.admin_ids
+            user_triggers = len(self._triggers_by_owner.get(user_id, ()))
+            is_admin = user_id in self._admin_ids
             max_triggers = 100 if is_admin else self.config.max_triggers_per_user
 
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -647,7 +1204,7 @@ class EnhancedTelegramBot:
 🎯 Выберите действие:"""
 
             await message.answer(menu_text, parse_mode="HTML", reply_markup=keyboard)
-            self.stats['commands_used']['triggers'] = self.stats['commands_used'].get('triggers', 0) + 1
+            self._track_command('triggers')
 
         except Exception as e:
             await self._handle_command_error(message, e, "triggers")
@@ -656,7 +1213,7 @@ class EnhancedTelegramBot:
         """Панель администратора."""
         try:
             user_id = message.from_user.id
-            if user_id not in self.config.admin_ids:
+            if user_id not in self._admin_ids:
                 await message.answer("❌ У вас нет прав администратора")
                 return
 
@@ -667,7 +1224,7 @@ class EnhancedTelegramBot:
 
 📊 <b>Статистика системы:</b>
 • Сообщений обработано: {self.stats['messages_processed']:,}
-• Уникальных пользователей: {len(self.stats['users_count']):,}
+• Уникальных пользователей: {self._unique_users():,}
 • Время работы: {uptime_str}
 • Ошибок: {self.stats['errors_count']}
 
@@ -685,111 +1242,153 @@ class EnhancedTelegramBot:
 💡 <i>Используйте команды с осторожностью!</i>"""
 
             await message.answer(admin_text, parse_mode="HTML")
-            self.stats['commands_used']['admin'] = self.stats['commands_used'].get('admin', 0) + 1
+            self._track_command('admin')
 
         except Exception as e:
             await self._handle_command_error(message, e, "admin")
 
+    async def _send_broadcast_message(self, user_id: int, text: str) -> bool:
+        """Отправляет одно сообщение рассылки в пределах лимита Telegram (30 msg/s)."""
+        async with self._broadcast_semaphore:
+            while True:
+                # Каждой отправке выдается свой слот: не чаще 30 в секунду
+                now = time.monotonic()
+                slot = max(now, self._broadcast_next_slot)
+                self._broadcast_next_slot = slot + 1 / 30
+                await asyncio.sleep(slot - now)
+
+                try:
+                    await self.bot.send_message(user_id, text)
+                    return True
+                except TelegramRetryAfter as e:
+                    # Повторяем только эту отправку
+                    await asyncio.sleep(e.retry_after)
+
+    async def _handle_broadcast(self, message: Message, command: CommandObject):
+        """Рассылка сообщения всем пользователям."""
+        try:
+            if message.from_user.id not in self._admin_ids:
+                await message.answer("❌ У вас нет прав администратора")
+                return
+
+            text = (command.args or "").strip()
+            if not text:
+                await message.answer("💡 Использование: <code>/broadcast [текст]</code>", parse_mode="HTML")
+                return
+
+            recipients = list(self.subscribers)
+            if not recipients:
+                await message.answer("📭 Некому отправлять: рассылка идет пользователям, нажавшим /start")
+                return
+            status_msg = await message.answer(f"📤 Рассылка на {len(recipients)} пользователей...")
+
+            # Ошибка одного получателя не прерывает рассылку
+            results = await asyncio.gather(
+                *(self._send_broadcast_message(user_id, text) for user_id in recipients),
+                return_exceptions=True
+            )
+            delivered = sum(1 for result in results if result is True)
+
+            await status_msg.edit_text(f"✅ Рассылка завершена: доставлено {delivered} из {len(recipients)}")
+            self._track_command('broadcast')
+
+        except Exception as e:
+            await self._handle_command_error(message, e, "broadcast")
+
     async def _handle_all_messages(self, message: Message):
         """Обработчик всех сообщений."""
         try:
             self.stats['messages_processed'] += 1
-            self.stats['users_count'].add(message.from_user.id)
 
-            # Проверяем триггеры
-            if self.config.triggers_enabled and message.text:
-                response = await self._check_triggers(message.text)
-                if response:
-                    await message.answer(response)
-                    return
+            # Фото, стикеры и служебные сообщения: ни триггеров, ни умных ответов
+            if not message.text:
+                return
+            ctx = MsgCtx(message=message, raw=message.text, lower=message.text.lower())
+
+            self.stats['users_hll'].update(str(message.from_user.id).encode())
 
-            # Умные ответы
-            if self.config.smart_responses and message.text:
-                response = await self._get_smart_response(message)
+            # Первый ответ из цепочки: триггеры, затем умные ответы
+            for responder in self._message_responders:
+                response = await responder(ctx)
                 if response:
                     await message.answer(response)
+                    return
 
         except Exception as e:
-            logger.error(f"Ошибка обработки сообщения: {e}")
+            logger.error("Ошибка обработки сообщения: %s", e)
             self.stats['errors_count'] += 1
 
-    async def _check_triggers(self, text: str) -> Optional[str]:
+    async def _check_triggers(self, ctx: MsgCtx) -> Optional[str]:
         """Проверяет триггеры для текста."""
         try:
-            for name, trigger in self.triggers.get('global', {}).items():
-                pattern = trigger['pattern']
-                trigger_type = trigger['type']
-                response = trigger['response']
-
-                match = False
-
-                if trigger_type == 'contains' and pattern.lower() in text.lower():
-                    match = True
-                elif trigger_type == 'exact' and pattern.lower() == text.lower():
-                    match = True
-                elif trigger_type == 'starts_with' and text.lower().startswith(pattern.lower()):
-                    match = True
-                elif trigger_type == 'ends_with' and text.lower().endswith(pattern.lower()):
-                    match = True
-                elif trigger_type == 'regex':
-                    try:
-                        if re.search(pattern, text, re.IGNORECASE):
-                            match = True
-                    except re.error:
-                        continue
-
-                if match:
-                    # Обновляем статистику использования
-                    trigger['usage_count'] = trigger.get('usage_count', 0) + 1
-                    await self._save_triggers()
-                    return response
+            text, text_lower = ctx.raw, ctx.lower
+            last_index = len(text_lower) - 1
+            candidates = []
+
+            # contains / starts_with / ends_with: один проход автомата по тексту
+            if self._automaton is not None:
+                for end_index, entries in self._automaton.iter(text_lower):
+                    for name, trigger_type, length in entries:
+                        if (trigger_type == 'contains'
+                                or (trigger_type == 'starts_with' and end_index + 1 == length)
+                                or (trigger_type == 'ends_with' and end_index == last_index)):
+                            candidates.append(name)
+
+            name = self._exact_triggers.get(text_lower)
+            if name is not None:
+                candidates.append(name)
+
+            # Как и раньше, срабатывает первый триггер в порядке создания
+            name = min(candidates, key=self._trigger_order.__getitem__) if candidates else None
+
+            if self._regex_triggers:
+                # Regex проверяются только среди созданных раньше лучшего кандидата
+                stop_order = self._trigger_order[name] if name is not None else len(self._trigger_order)
+                regex_name = _scan_regex_triggers(
+                    text, self._regex_union, self._regex_triggers, stop_order
+                )
+                if regex_name is not None:
+                    name = regex_name
+
+            if name is not None:
+                trigger = self.triggers['global'][name]
+
+                # Счетчик сохраняется на диск фоновой задачей
+                trigger['usage_count'] = trigger.get('usage_count', 0) + 1
+                self._triggers_dirty = True
+                return trigger['response']
 
         except Exception as e:
-            logger.error(f"Ошибка проверки триггеров: {e}")
+            logger.error("Ошибка проверки триггеров: %s", e)
 
         return None
 
-    async def _get_smart_response(self, message: Message) -> Optional[str]:
+    async def _get_smart_response(self, ctx: MsgCtx) -> Optional[str]:
         """Генерирует умный ответ на сообщение."""
-        text = message.text.lower() if message.text else ""
-
-        # Простые паттерны для демо
-        if any(word in text for word in ['привет', 'hello', 'hi', 'здарова']):
-            return f"👋 Привет, {message.from_user.first_name}! Как дела?"
-
-        if any(word in text for word in ['как дела', 'как поживаешь', 'что нового']):
-            return "😊 Отлично! Работаю, помогаю пользователям. А у вас как дела?"
-
-        if any(word in text for word in ['спасибо', 'благодарю', 'thanks']):
-            return "😊 Пожалуйста! Рад помочь!"
-
-        if '?' in text and len(text) > 10:
-            return "🤔 Интересный вопрос! В полной версии с AI я дам более умный ответ."
-
-        if any(word in text for word in ['бот', 'робот', 'bot']):
-            return "🤖 Да, я Enhanced Bot v3.0! Чем могу помочь?"
-
-        return None
+        text = ctx.lower.strip()
+        # Префильтр: без единого возможного первого символа ключевого слова ответа нет,
+        # и такие сообщения не вытесняют полезные записи из кэша
+        if len(text) < 2 or _KEYWORD_FIRST_CHARS.isdisjoint(text):
+            return None
+        kind = _smart_response_kind(text)
+        if kind is None:
+            return None
+        return _SMART_RESPONSES[kind].format(first_name=ctx.message.from_user.first_name)
 
     async def _handle_command_error(self, message: Message, error: Exception, command: str):
         """Обработка ошибок команд."""
-        logger.error(f"Ошибка в команде /{command}: {error}")
+        logger.error("Ошибка в команде /%s: %s", command, error)
         self.stats['errors_count'] += 1
 
-        await message.answer(
-            f"❌ Произошла ошибка при выполнении команды /{command}\n"
-            f"💡 Попробуйте позже или обратитесь к администратору",
-            parse_mode="HTML"
-        )
+        await message.answer(_COMMAND_ERROR_TEXT(cmd=command), parse_mode="HTML")
 
     async def _handle_error(self, event, exception):
         """Глобальный обработчик ошибок."""
-        logger.error(f"Глобальная ошибка: {exception}")
+        logger.error("Глобальная ошибка: %s", exception)
         self.stats['errors_count'] += 1
         return True
 
     # Заглушки для остальных методов (для краткости)
-    async def _handle_broadcast(self, message: Message): pass
     async def _handle_ban(self, message: Message): pass  
     async def _handle_mute(self, message: Message): pass
     async def _handle_trigger_callback(self, callback: CallbackQuery): pass
@@ -802,11 +1401,16 @@ class EnhancedTelegramBot:
         try:
             logger.info("🚀 Запуск Enhanced Telegram Bot v3.0...")
 
-            # Проверяем соединение
-            bot_info = await self.bot.get_me()
-            logger.info(f"✅ Подключен как @{bot_info.username}")
-            logger.info(f"👑 Администраторы: {self.config.admin_ids}")
-            logger.info(f"⚡ Функции: Smart={self.config.smart_responses}, Triggers={self.config.triggers_enabled}")
+            # bot.me() запоминает ответ: start_polling возьмет его же, второго getMe не будет
+            bot_info = await self.bot.me()
+            logger.info("✅ Подключен как @%s", bot_info.username)
+            logger.info("👑 Администраторы: %s", self.config.admin_ids)
+            logger.info("⚡ Функции: Smart=%s, Triggers=%s", self.config.smart_responses, self.config.triggers_enabled)
+
+            # Фоновая очистка rate limiting
+            self._gc_task = asyncio.create_task(self._rate_limit_gc())
+            self._flush_task = asyncio.create_task(self._trigger_flush_loop())
+            self._cmd_rotate_task = asyncio.create_task(self._rotate_command_buckets())
 
             # Запускаем polling
             await self.dp.start_polling(self.bot)
@@ -814,7 +1418,7 @@ class EnhancedTelegramBot:
         except KeyboardInterrupt:
             logger.info("👋 Получен сигнал остановки")
         except Exception as e:
-            logger.error(f"❌ Критическая ошибка: {e}")
+            logger.error("❌ Критическая ошибка: %s", e)
             raise
         finally:
             await self.shutdown()
@@ -824,30 +1428,48 @@ class EnhancedTelegramBot:
         try:
             logger.info("🔄 Завершение работы бота...")
 
-            # Сохраняем триггеры
+            # Периодические задачи и еще не завершенные фоновые (правка /ping) - до закрытия сессий
+            tasks = [task for task in (self._gc_task, self._flush_task, self._cmd_rotate_task) if task]
+            tasks.extend(self._background_tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            # Сохраняем триггеры и подписчиков
             await self._save_triggers()
+            await self._save_subscribers()
 
+            await self.dp.storage.close()
             if self.bot:
                 await self.bot.session.close()
 
             logger.info("✅ Бот завершил работу корректно")
 
         except Exception as e:
-            logger.error(f"❌ Ошибка при завершении: {e}")
+            logger.error("❌ Ошибка при завершении: %s", e)
 
 def main():
     """Главная функция."""
     try:
         bot = EnhancedTelegramBot()
-        asyncio.run(bot.start())
+
+        # uvloop там, где он есть; на Windows - selector loop для aiohttp
+        try:
+            import uvloop
+        except ImportError:
+            if sys.platform == 'win32':
+                asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+            asyncio.run(bot.start())
+        else:
+            uvloop.run(bot.start())
 
     except ValueError as e:
-        logger.error(f"❌ Ошибка конфигурации: {e}")
+        logger.error("❌ Ошибка конфигурации: %s", e)
         logger.info("💡 Проверьте настройки в .env файле")
         sys.exit(1)
 
     except Exception as e:
-        logger.error(f"❌ Критическая ошибка: {e}")
+        logger.error("❌ Критическая ошибка: %s", e)
         sys.exit(1)
 
 if __name__ == '__main__':
@@ -14,6 +14,12 @@ pydantic==2.8.0
 # Async File Operations
 aiofiles==23.2.0
 
+# Performance (production_main.py: triggers, JSON, event loop)
+pyahocorasick==2.1.0
+orjson==3.10.7
+google-re2==1.1
+uvloop==0.19.0; sys_platform != "win32"
+
 # Database (SQLite Async)
 aiosqlite==0.19.0
 
@@ -370,13 +376,16 @@ RUN mkdir -p data logs backups triggers exports charts && \\
 # Копируем код приложения
 COPY --chown=botuser:botuser . .
 
+# Байткод компилируется при сборке рядом с кодом (__pycache__); без PYTHONPYCACHEPREFIX,
+# иначе Python перестает читать уже собранные .pyc stdlib и site-packages
+RUN python -m compileall -q -j 0 main.py config_harsh.py database.py app/
+
 # Переключаемся на пользователя botuser
 USER botuser
 
 # Настраиваем переменные окружения
 ENV PYTHONPATH=/app
 ENV PYTHONUNBUFFERED=1
-ENV PYTHONDONTWRITEBYTECODE=1
 
 # Открываем порт для health check
 EXPOSE 8080
@@ -386,8 +395,7 @@ HEALTHCHECK --interval=30s --timeout=10s --start-period=30s --retries=3 \\
     CMD python -c "print('Bot is healthy')" || exit 1
 
 # Команда запуска
-CMD ["python", "main.py"]
-"""
+CMD ["python", "main.py"]"""
 
 with open('production_Dockerfile.txt', 'w', encoding='utf-8') as f:
     f.write(production_dockerfile)
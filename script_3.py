@@ -333,24 +333,24 @@ def validate_user_input(text: str) -> Optional[str]:
 
 ## 3. Rate Limiting
 ```python
-from collections import defaultdict
+from collections import deque
 import time
 
 class RateLimiter:
     def __init__(self, max_requests: int = 30, time_window: int = 60):
         self.max_requests = max_requests
         self.time_window = time_window
-        self.requests = defaultdict(list)
+        self.requests: dict[int, deque] = {}
     
     def is_allowed(self, user_id: int) -> bool:
-        now = time.time()
-        user_requests = self.requests[user_id]
-        
-        # Очищаем старые запросы
-        user_requests[:] = [req_time for req_time in user_requests 
-                           if now - req_time < self.time_window]
+        now = time.monotonic()
+        user_requests = self.requests.get(user_id)
+        if user_requests is None:
+            user_requests = self.requests[user_id] = deque(maxlen=self.max_requests)
         
-        if len(user_requests) >= self.max_requests:
+        # Кольцевой буфер: старые отметки вытесняются сами, проверяем только самую раннюю
+        if (len(user_requests) == self.max_requests
+                and now - user_requests[0] < self.time_window):
             return False
         
         user_requests.append(now)
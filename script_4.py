@@ -1,3 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+def _dump(path, data):
+    """Записывает файл целиком: кодируем один раз и пишем байты без текстового слоя."""
+    Path(path).write_bytes(data.encode('utf-8'))
+
+
 # Создадим правильный .env.example файл
 env_example = """# ==============================================
 # Enhanced Telegram Bot v3.0 - Конфигурация
@@ -63,37 +72,51 @@ LANGUAGE=ru
 DEBUG=false
 """
 
-# Сохраним .env.example
-with open('correct_env_example.txt', 'w', encoding='utf-8') as f:
-    f.write(env_example)
-
 # Создадим правильный Dockerfile
-dockerfile_content = """# Enhanced Telegram Bot v3.0 - Dockerfile
-FROM python:3.11-slim
+dockerfile_content = """# syntax=docker/dockerfile:1.7
+# Enhanced Telegram Bot v3.0 - Dockerfile
 
-# Устанавливаем рабочую директорию
-WORKDIR /app
+# ===== Этап сборки: компилятор и зависимости =====
+FROM python:3.11-slim AS builder
 
-# Устанавливаем системные зависимости
-RUN apt-get update && apt-get install -y \\
-    gcc \\
-    && rm -rf /var/lib/apt/lists/*
+# Устанавливаем системные зависимости (кэш apt сохраняется между сборками)
+RUN --mount=type=cache,target=/var/cache/apt,sharing=locked \\
+    --mount=type=cache,target=/var/lib/apt/lists,sharing=locked \\
+    rm -f /etc/apt/apt.conf.d/docker-clean && \\
+    apt-get update && apt-get install -y --no-install-recommends gcc
+
+# Зависимости ставим в отдельное окружение, чтобы перенести его без gcc
+RUN python -m venv /opt/venv
+ENV PATH="/opt/venv/bin:$PATH"
 
 # Копируем файлы зависимостей
 COPY requirements.txt .
 
-# Устанавливаем Python зависимости
-RUN pip install --no-cache-dir -r requirements.txt
+# Устанавливаем Python зависимости (кэш pip сохраняется между сборками)
+RUN --mount=type=cache,target=/root/.cache/pip \\
+    pip install -r requirements.txt
+
+# ===== Итоговый образ: только окружение и код =====
+FROM python:3.11-slim
 
-# Создаем пользователя для безопасности
-RUN useradd --create-home --shell /bin/bash bot_user
+# Устанавливаем рабочую директорию
+WORKDIR /app
 
-# Создаем необходимые директории
-RUN mkdir -p data/logs data/charts data/exports data/backups data/triggers && \\
+# Переносим готовое окружение из этапа сборки
+COPY --from=builder /opt/venv /opt/venv
+ENV PATH="/opt/venv/bin:$PATH"
+
+# Создаем пользователя для безопасности и необходимые директории одним слоем
+RUN useradd --create-home --shell /bin/bash bot_user && \\
+    mkdir -p data/logs data/charts data/exports data/backups data/triggers && \\
     chown -R bot_user:bot_user /app
 
-# Копируем код приложения
-COPY . .
+# Копируем код приложения последним: правки кода не сбрасывают кэш слоев выше
+COPY --chown=bot_user:bot_user . .
+
+# Байткод компилируется при сборке рядом с кодом (__pycache__); без PYTHONPYCACHEPREFIX,
+# иначе Python перестает читать уже собранные .pyc stdlib и site-packages
+RUN python -m compileall -q -j 0 main.py config_harsh.py database.py app/
 
 # Переключаемся на пользователя bot_user
 USER bot_user
@@ -105,18 +128,14 @@ ENV PYTHONUNBUFFERED=1
 # Порт (если нужен веб-интерфейс)
 EXPOSE 8000
 
-# Проверка здоровья
+# Проверка здоровья (только stdlib; urlopen завершится ошибкой на любой не-2xx ответ)
 HEALTHCHECK --interval=30s --timeout=10s --start-period=5s --retries=3 \\
-    CMD python -c "import requests; requests.get('http://localhost:8000/health')" || exit 1
+    CMD python -c "import urllib.request; urllib.request.urlopen('http://localhost:8000/health', timeout=3)" || exit 1
 
 # Команда запуска
 CMD ["python", "main.py"]
 """
 
-# Сохраним Dockerfile
-with open('correct_Dockerfile.txt', 'w', encoding='utf-8') as f:
-    f.write(dockerfile_content)
-
 # Создадим docker-compose.yml
 docker_compose_content = """version: '3.8'
 
@@ -175,10 +194,6 @@ volumes:
   postgres_data:
 """
 
-# Сохраним docker-compose.yml
-with open('correct_docker_compose.yml', 'w', encoding='utf-8') as f:
-    f.write(docker_compose_content)
-
 # Создадим .gitignore
 gitignore_content = """# Переменные окружения
 .env
@@ -272,16 +287,6 @@ docker-compose.override.yml
 *.backup
 """
 
-# Сохраним .gitignore
-with open('correct_gitignore.txt', 'w', encoding='utf-8') as f:
-    f.write(gitignore_content)
-
-print("Созданы дополнительные конфигурационные файлы:")
-print("- correct_env_example.txt - правильный пример .env")
-print("- correct_Dockerfile.txt - оптимизированный Dockerfile") 
-print("- correct_docker_compose.yml - конфигурация Docker Compose")
-print("- correct_gitignore.txt - правильный .gitignore")
-
 # Создадим итоговую сводку
 summary = """
 # ИТОГОВАЯ СВОДКА АНАЛИЗА ПРОЕКТА anh-fork2
@@ -358,7 +363,22 @@ summary = """
 Проект имеет амбициозную документацию, но критически нуждается в реальной реализации и исправлении архитектурных недочетов.
 """
 
-with open('project_analysis_summary.md', 'w', encoding='utf-8') as f:
-    f.write(summary)
-
-print("\n📋 Создана итоговая сводка: project_analysis_summary.md")
\ No newline at end of file
+# Сохраним все файлы: пути не пересекаются, пишем параллельно
+output_files = (
+    ('correct_env_example.txt', env_example),
+    ('correct_Dockerfile.txt', dockerfile_content),
+    ('correct_docker_compose.yml', docker_compose_content),
+    ('correct_gitignore.txt', gitignore_content),
+    ('project_analysis_summary.md', summary),
+)
+with ThreadPoolExecutor(max_workers=len(output_files)) as executor:
+    list(executor.map(lambda item: _dump(*item), output_files))
+
+print("\n".join((
+    "Созданы дополнительные конфигурационные файлы:",
+    "- correct_env_example.txt - правильный пример .env",
+    "- correct_Dockerfile.txt - оптимизированный Dockerfile",
+    "- correct_docker_compose.yml - конфигурация Docker Compose",
+    "- correct_gitignore.txt - правильный .gitignore",
+    "\n📋 Создана итоговая сводка: project_analysis_summary.md",
+)))
\ No newline at end of file